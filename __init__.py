@@ -33,8 +33,12 @@ from . import addon_updater_ops
 auto_load.init()
 
 submodules = [
+    "cache",
     "panels",
+    "library",
     "properties",
+    "usage",
+    "environment",
     "operators",
 ]
 
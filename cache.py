@@ -0,0 +1,87 @@
+import bpy
+from bpy.app.handlers import persistent
+from bpy.types import Material, NodeTree
+from typing import Callable, Iterable, Set, Tuple
+from .common import invalidate_node_index
+
+class ToonShadeNodeCache():
+    """Per-material cache of the Toon Shade nodes found in its node tree.
+
+    An entry stays valid until a depsgraph update reports the material, its
+    node tree or one of the node groups walked while building it.
+    """
+    def __init__(self):
+        self.entries = {}
+        # Bumped on every material or node tree update, for caches keyed on "anything changed"
+        self.revision = 0
+
+    def get(self, material: Material, build: Callable[[Material], Tuple[object, Iterable]]):
+        """Get the cached value for a material, building it if needed
+
+        Args:
+            material (bpy.types.Material): The material to look up
+            build (Callable): Called with the material on a miss. Returns the value
+                and the datablocks (materials, node trees) the value depends on
+
+        Returns:
+            The cached value
+        """
+        key = material.as_pointer()
+        node_tree_pointer = material.node_tree.as_pointer() if material.node_tree else 0
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != node_tree_pointer:
+            value, dependencies = build(material)
+            dependency_pointers = {key, node_tree_pointer}
+            dependency_pointers.update(id_data.as_pointer() for id_data in dependencies)
+            entry = self.entries[key] = (node_tree_pointer, value, dependency_pointers)
+        return entry[1]
+
+    def invalidate(self, pointers: Set[int]):
+        """Drop every entry that depends on one of the given datablocks
+
+        Args:
+            pointers (Set[int]): ``as_pointer()`` values of the updated datablocks
+        """
+        self.revision += 1
+        stale_keys = [key for key, entry in self.entries.items() if entry[2] & pointers]
+        for key in stale_keys:
+            del self.entries[key]
+
+    def clear(self):
+        self.entries.clear()
+        self.revision += 1
+
+toonshade_node_cache = ToonShadeNodeCache()
+
+@persistent
+def on_depsgraph_update_post(scene, depsgraph):
+    updated_pointers = set()
+    for update in depsgraph.updates:
+        if isinstance(update.id, (Material, NodeTree)):
+            id_data = update.id.original
+            updated_pointers.add(id_data.as_pointer())
+            node_tree = id_data.node_tree if isinstance(id_data, Material) else id_data
+            if node_tree:
+                invalidate_node_index(node_tree)
+    if updated_pointers:
+        toonshade_node_cache.invalidate(updated_pointers)
+
+@persistent
+def on_data_reloaded(*args):
+    # Undo and file loads reallocate datablocks and nodes, so nothing cached survives them
+    toonshade_node_cache.clear()
+    invalidate_node_index()
+
+def register():
+    bpy.app.handlers.depsgraph_update_post.append(on_depsgraph_update_post)
+    bpy.app.handlers.load_post.append(on_data_reloaded)
+    bpy.app.handlers.undo_post.append(on_data_reloaded)
+    bpy.app.handlers.redo_post.append(on_data_reloaded)
+
+def unregister():
+    bpy.app.handlers.redo_post.remove(on_data_reloaded)
+    bpy.app.handlers.undo_post.remove(on_data_reloaded)
+    bpy.app.handlers.load_post.remove(on_data_reloaded)
+    bpy.app.handlers.depsgraph_update_post.remove(on_depsgraph_update_post)
+    toonshade_node_cache.clear()
+    invalidate_node_index()
@@ -1,7 +1,9 @@
 import bpy
-from bpy.types import Node, NodeTree
+from bpy.types import ID, Node, NodeTree
 import os
-from typing import List
+import hashlib
+from collections.abc import Mapping
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
 
 def get_addon_filepath():
     return os.path.dirname(bpy.path.abspath(__file__)) + os.sep
@@ -24,44 +26,556 @@ def get_active_material_output(node_tree: NodeTree) -> Node:
             return node
     return None
 
-def get_connected_nodes(output_node: Node) -> List[Node]:
+def get_link_map(node_tree: NodeTree) -> Dict[Node, List[Node]]:
+    """Build a reverse adjacency snapshot of a node tree
+
+    Reads ``node_tree.links`` once instead of going through ``socket.links``,
+    which scans every link of the tree on each access.
+
+    Args:
+        node_tree (bpy.types.NodeTree): The node tree to snapshot
+
+    Returns:
+        Dict[bpy.types.Node, List[bpy.types.Node]]: Maps each node to the nodes linked into its inputs
+    """
+    link_map = {}
+    for link in node_tree.links:
+        link_map.setdefault(link.to_node, []).append(link.from_node)
+    return link_map
+
+class ConnectedNodes(Mapping):
+    """Nodes connected to an output node, keyed by instance path
+
+    A path is a tuple of node names: the group nodes leading into a nested
+    node tree, followed by the node itself. Every distinct node tree is walked
+    only once, and trees shared by several group nodes are expanded lazily
+    when iterating.
+    """
+    def __init__(self, root_tree: NodeTree):
+        self.root_tree = root_tree
+        # Nodes found in each walked node tree, by name, in order of discovery
+        self.tree_nodes: Dict[NodeTree, Dict[str, Node]] = {}
+
+    def walk(self, node_tree: NodeTree = None, prefix: Tuple[str, ...] = ()) -> Iterator[Tuple[Tuple[str, ...], Node]]:
+        """Yield (instance path, node) pairs in order of discovery"""
+        for name, node in self.tree_nodes[node_tree or self.root_tree].items():
+            path = prefix + (name,)
+            yield path, node
+            sub_tree = getattr(node, 'node_tree', None)
+            if sub_tree:
+                yield from self.walk(sub_tree, path)
+
+    def items(self):
+        return self.walk()
+
+    def __iter__(self):
+        return (path for path, _ in self.walk())
+
+    def __getitem__(self, path: Tuple[str, ...]) -> Node:
+        node_tree = self.root_tree
+        node = None
+        for name in path:
+            if node is not None:
+                node_tree = getattr(node, 'node_tree', None)
+            node = self.tree_nodes.get(node_tree, {}).get(name)
+            if node is None:
+                raise KeyError(path)
+        if node is None:
+            raise KeyError(path)
+        return node
+
+    def __len__(self):
+        counts = {}
+
+        def count(node_tree):
+            if node_tree not in counts:
+                total = 0
+                for node in self.tree_nodes[node_tree].values():
+                    sub_tree = getattr(node, 'node_tree', None)
+                    total += 1 + (count(sub_tree) if sub_tree else 0)
+                counts[node_tree] = total
+            return counts[node_tree]
+
+        return count(self.root_tree)
+
+    def nodes(self) -> List[Node]:
+        """Get every distinct node once, preserving the order of discovery"""
+        nodes = []
+        seen_trees = set()
+
+        def collect(node_tree):
+            seen_trees.add(node_tree)
+            for node in self.tree_nodes[node_tree].values():
+                nodes.append(node)
+                sub_tree = getattr(node, 'node_tree', None)
+                if sub_tree and sub_tree not in seen_trees:
+                    collect(sub_tree)
+
+        collect(self.root_tree)
+        return nodes
+
+    def node_trees(self) -> List[NodeTree]:
+        """Get every distinct node tree that was walked"""
+        return list(self.tree_nodes)
+
+def get_connected_nodes(output_node: Node) -> ConnectedNodes:
     """
-    Gets all nodes connected to the given output_node, 
-    maintaining the order in which they were found and removing duplicates.
+    Gets all nodes connected to the given output_node.
+    Nested node groups are walked once per distinct node tree,
+    however many group nodes use them.
 
     Args:
-        node: The output node.
+        output_node: The output node.
 
     Returns:
-        A list of nodes, preserving the order of discovery and removing duplicates.
+        ConnectedNodes: The connected nodes, keyed by instance path.
     """
+    connected = ConnectedNodes(output_node.id_data)
 
-    nodes = []
-    visited = set()  # Here's where the set is used
-
-    def traverse(node: Node):
-        if node not in visited:  # Check if the node has been visited
-            visited.add(node)  # Add the node to the visited set
-            nodes.append(node)
-            if hasattr(node, 'node_tree') and node.node_tree:
-                for sub_node in node.node_tree.nodes:
-                    traverse(sub_node)
-            for input in node.inputs:
-                for link in input.links:
-                    traverse(link.from_node)
-
-    traverse(output_node)
-    return nodes
+    def walk_tree(node_tree: NodeTree, start_nodes):
+        tree_nodes = connected.tree_nodes[node_tree] = {}
+        link_map = get_link_map(node_tree)
 
-def find_node(node_tree, node_details):
-    if not node_tree:
+        def traverse(node: Node):
+            if node.name in tree_nodes:
+                return
+            tree_nodes[node.name] = node
+            sub_tree = getattr(node, 'node_tree', None)
+            if sub_tree and sub_tree not in connected.tree_nodes:
+                walk_tree(sub_tree, sub_tree.nodes)
+            for from_node in link_map.get(node, []):
+                traverse(from_node)
+
+        for node in start_nodes:
+            traverse(node)
+
+    walk_tree(connected.root_tree, [output_node])
+    return connected
+
+def search_nodes(output_node: Node,
+                 match: Callable[[Node], bool],
+                 skip: Optional[Callable[[Node], bool]] = None,
+                 limit: Optional[int] = None,
+                 node_trees: Optional[Set[NodeTree]] = None) -> Iterator[Tuple[Tuple[str, ...], Node]]:
+    """
+    Lazily search the nodes connected to the given output_node.
+    The graph is walked in the same order as get_connected_nodes, but only as far
+    as the caller consumes the results, and the matches of a nested node tree are
+    remembered so that further group nodes using it do not walk it again.
+
+    Args:
+        output_node: The output node.
+        match: Nodes for which this returns True are yielded.
+        skip (optional): Group nodes for which this returns True are not descended into.
+        limit (optional): Stop after this many matches.
+        node_trees (optional): Filled with every node tree that gets searched.
+
+    Yields:
+        (instance path, node) for every matching node.
+    """
+    tree_matches = {}  # Matches of every fully searched nested node tree, by relative path
+
+    def search_tree(node_tree: NodeTree, start_nodes):
+        if node_trees is not None:
+            node_trees.add(node_tree)
+        visited = set()
+        matches = []
+        link_map = get_link_map(node_tree)
+
+        def traverse(node: Node):
+            if node.name in visited:
+                return
+            visited.add(node.name)
+            path = (node.name,)
+            if match(node):
+                matches.append((path, node))
+                yield path, node
+            sub_tree = getattr(node, 'node_tree', None)
+            if sub_tree and not (skip and skip(node)):
+                for sub_path, sub_node in search_sub_tree(sub_tree):
+                    item = (path + sub_path, sub_node)
+                    matches.append(item)
+                    yield item
+            for from_node in link_map.get(node, []):
+                yield from traverse(from_node)
+
+        for node in start_nodes:
+            yield from traverse(node)
+        tree_matches[node_tree] = matches
+
+    def search_sub_tree(sub_tree: NodeTree):
+        if sub_tree in tree_matches:
+            return iter(tree_matches[sub_tree])
+        return search_tree(sub_tree, sub_tree.nodes)
+
+    if limit is not None and limit <= 0:
+        return
+    found = 0
+    for item in search_tree(output_node.id_data, [output_node]):
+        yield item
+        found += 1
+        if limit is not None and found >= limit:
+            return
+
+# Per node tree attribute indexes: (tree pointer, attribute names) -> (node count, {attribute values: node names})
+_node_indexes = {}
+# Stands for an attribute a node does not have, so nodes of every type can be indexed together
+_MISSING_ATTRIBUTE = object()
+
+def node_matches(node: Node, node_details: dict) -> bool:
+    for key, value in node_details.items():
+        if getattr(node, key, _MISSING_ATTRIBUTE) != value:
+            return False
+    return True
+
+def get_node_index(node_tree: NodeTree, keys: Tuple[str, ...]) -> Optional[Dict[tuple, List[str]]]:
+    """Get the names of a node tree's nodes by the values of the given attributes
+
+    The index is cached until invalidate_node_index is called for the tree,
+    or until its node count changes. Nodes without one of the attributes are
+    indexed too, they just never match a lookup on it. Only names are kept,
+    never the nodes themselves, so a stale index can miss a node but never
+    hand out a removed one. Code adding or removing nodes should still
+    invalidate the index, as removing and adding as many nodes keeps the count.
+
+    Args:
+        node_tree (bpy.types.NodeTree): The node tree to index
+        keys (Tuple[str, ...]): The node attribute names to index by
+
+    Returns:
+        Dict[tuple, List[str]]: Node names by attribute values, or None if a value is not hashable
+    """
+    cache_key = (node_tree.as_pointer(), keys)
+    node_count = len(node_tree.nodes)
+    cached = _node_indexes.get(cache_key)
+    if cached and cached[0] == node_count:
+        return cached[1]
+    index = {}
+    try:
+        for node in node_tree.nodes:
+            index.setdefault(tuple(getattr(node, key, _MISSING_ATTRIBUTE) for key in keys), []).append(node.name)
+    except TypeError:
+        # Unhashable attribute values (vectors, colors...) can only be compared one by one
         return None
-    for node in node_tree.nodes:
-        match = True
-        for key, value in node_details.items():
-            if getattr(node, key) != value:
-                match = False
-                break
-        if match:
-            return node
-    return None
\ No newline at end of file
+    _node_indexes[cache_key] = (node_count, index)
+    return index
+
+def invalidate_node_index(node_tree: NodeTree = None):
+    """Drop the cached attribute indexes of a node tree, or of every node tree if none is given"""
+    if node_tree is None:
+        _node_indexes.clear()
+        return
+    pointer = node_tree.as_pointer()
+    for cache_key in [cache_key for cache_key in _node_indexes if cache_key[0] == pointer]:
+        del _node_indexes[cache_key]
+
+def find_nodes(node_tree, node_details) -> List[Node]:
+    """Find every node whose attributes match the given details
+
+    Args:
+        node_tree (bpy.types.NodeTree): The node tree to search
+        node_details (dict): Node attribute names and the values they must have
+
+    Returns:
+        List[bpy.types.Node]: The matching nodes
+    """
+    if not node_tree:
+        return []
+    if "name" in node_details:
+        # Node names are unique, so a name lookup settles it
+        node = node_tree.nodes.get(node_details["name"])
+        return [node] if node and node_matches(node, node_details) else []
+    keys = tuple(node_details)
+    index = get_node_index(node_tree, keys)
+    if index is None:
+        return [node for node in node_tree.nodes if node_matches(node, node_details)]
+    # The index may predate an edit the depsgraph has not reported yet
+    nodes = (node_tree.nodes.get(name) for name in index.get(tuple(node_details.values()), ()))
+    return [node for node in nodes if node and node_matches(node, node_details)]
+
+def find_nodes_in_trees(node_trees, node_details) -> Dict[NodeTree, List[Node]]:
+    """Find every node whose attributes match the given details across several node trees
+
+    Args:
+        node_trees (Iterable[bpy.types.NodeTree]): The node trees to search
+        node_details (dict): Node attribute names and the values they must have
+
+    Returns:
+        Dict[bpy.types.NodeTree, List[bpy.types.Node]]: The matching nodes of every node tree with a match
+    """
+    found = {}
+    for node_tree in node_trees:
+        nodes = find_nodes(node_tree, node_details)
+        if nodes:
+            found[node_tree] = nodes
+    return found
+
+def find_node(node_tree, node_details):
+    nodes = find_nodes(node_tree, node_details)
+    return nodes[0] if nodes else None
+
+# Properties that only change how a node looks in the editor, or that are hashed separately
+NODE_HASH_SKIPPED_PROPERTIES = {
+    "rna_type", "name", "label", "location", "location_absolute", "width", "width_hidden", "height",
+    "dimensions", "select", "show_options", "show_preview", "show_texture", "hide", "color",
+    "use_custom_color", "parent", "inputs", "outputs", "internal_links", "type",
+    }
+
+def get_rna_state(struct, hashes: Dict[NodeTree, str], skipped=("rna_type",)) -> tuple:
+    """Get a hashable snapshot of the editable properties of an RNA struct
+
+    Nested node trees are represented by their hash, other datablocks by name.
+    """
+    state = []
+    for prop in struct.bl_rna.properties:
+        identifier = prop.identifier
+        if identifier in skipped or identifier.startswith("bl_"):
+            continue
+        value = getattr(struct, identifier, None)
+        if prop.type == 'COLLECTION':
+            value = tuple(get_rna_state(item, hashes) for item in value)
+        elif prop.type == 'POINTER':
+            if value is None:
+                pass
+            elif isinstance(value, NodeTree):
+                value = get_node_tree_hash(value, hashes)
+            elif isinstance(value, ID):
+                value = value.name_full
+            elif prop.is_readonly:
+                # Owned data such as color ramps and curve mappings
+                value = get_rna_state(value, hashes)
+            else:
+                continue
+        elif prop.is_readonly:
+            continue
+        state.append((identifier, get_value_state(value)))
+    return tuple(state)
+
+def get_value_state(value):
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, set):
+        return tuple(sorted(value))
+    if isinstance(value, (bool, int, str, tuple)) or value is None:
+        return value
+    try:
+        return tuple(get_value_state(item) for item in value)
+    except TypeError:
+        return repr(value)
+
+def get_node_tree_hash(node_tree: NodeTree, hashes: Dict[NodeTree, str] = None) -> str:
+    """Get a hash of the structure of a node tree
+
+    Covers the interface, the node types and their settings, the unlinked
+    input values and the links. Editor-only state such as node locations is
+    left out, and nested node groups contribute their own hash rather than
+    their name.
+
+    Args:
+        node_tree (bpy.types.NodeTree): The node tree to hash
+        hashes (Dict[bpy.types.NodeTree, str], optional): Already computed hashes, filled as node trees get hashed
+
+    Returns:
+        str: The hex digest
+    """
+    if hashes is None:
+        hashes = {}
+    if node_tree in hashes:
+        return hashes[node_tree]
+
+    interface = tuple(
+        (item.item_type, getattr(item, "in_out", None), getattr(item, "socket_type", None), item.name,
+         get_value_state(getattr(item, "default_value", None)))
+        for item in node_tree.interface.items_tree
+        )
+    nodes = []
+    for node in sorted(node_tree.nodes, key=lambda node: node.name):
+        inputs = tuple(
+            (socket.identifier, get_value_state(getattr(socket, "default_value", None)))
+            for socket in node.inputs if not socket.is_linked
+            )
+        nodes.append((node.name, node.bl_idname, get_rna_state(node, hashes, NODE_HASH_SKIPPED_PROPERTIES), inputs))
+    links = sorted(
+        (link.from_node.name, link.from_socket.identifier, link.to_node.name, link.to_socket.identifier, link.is_muted)
+        for link in node_tree.links
+        )
+
+    digest = hashlib.sha1(repr((node_tree.bl_idname, interface, tuple(nodes), tuple(links))).encode()).hexdigest()
+    hashes[node_tree] = digest
+    return digest
+
+# Properties that patch_node_tree handles separately or must not touch
+NODE_PATCH_SKIPPED_PROPERTIES = {
+    "rna_type", "name", "parent", "select", "location_absolute", "dimensions",
+    "inputs", "outputs", "internal_links", "type", "node_tree",
+    }
+INTERFACE_SOCKET_PATCHED_PROPERTIES = (
+    "default_value", "min_value", "max_value", "description", "hide_value", "hide_in_modifier",
+    )
+
+def get_interface_signature(node_tree: NodeTree) -> tuple:
+    return tuple(
+        (item.item_type, getattr(item, "in_out", None), getattr(item, "socket_type", None), item.name,
+         getattr(item, "identifier", None))
+        for item in node_tree.interface.items_tree
+        )
+
+def set_if_different(struct, identifier: str, value) -> bool:
+    """Set an RNA property only if its value changes, so unchanged data is never tagged for an update"""
+    if get_value_state(getattr(struct, identifier)) == get_value_state(value):
+        return False
+    try:
+        setattr(struct, identifier, value)
+    except (AttributeError, TypeError, ValueError) as e:
+        print(f"Could not set {identifier} on {struct}: {e}")
+        return False
+    return True
+
+def patch_collection_length(collection, length: int, new_item):
+    while len(collection) > length:
+        collection.remove(collection[-1])
+    while len(collection) < length:
+        new_item(collection)
+
+def patch_color_ramp(color_ramp, source_ramp):
+    for identifier in ("color_mode", "interpolation", "hue_interpolation"):
+        set_if_different(color_ramp, identifier, getattr(source_ramp, identifier))
+    # A color ramp always keeps at least one element
+    patch_collection_length(color_ramp.elements, len(source_ramp.elements), lambda elements: elements.new(1.0))
+    for element, source_element in zip(color_ramp.elements, source_ramp.elements):
+        set_if_different(element, "position", source_element.position)
+        set_if_different(element, "color", source_element.color)
+        set_if_different(element, "alpha", source_element.alpha)
+
+def patch_curve_mapping(mapping, source_mapping):
+    changed = False
+    for identifier in ("use_clip", "clip_min_x", "clip_min_y", "clip_max_x", "clip_max_y", "extend"):
+        if hasattr(source_mapping, identifier):
+            changed |= set_if_different(mapping, identifier, getattr(source_mapping, identifier))
+    for curve, source_curve in zip(mapping.curves, source_mapping.curves):
+        if len(curve.points) != len(source_curve.points):
+            # Curves keep at least two points, so rebuild them from the source
+            patch_collection_length(curve.points, len(source_curve.points), lambda points: points.new(0.0, 0.0))
+            changed = True
+        for point, source_point in zip(curve.points, source_curve.points):
+            changed |= set_if_different(point, "location", source_point.location)
+            changed |= set_if_different(point, "handle_type", source_point.handle_type)
+    if changed:
+        mapping.update()
+
+def patch_rna_properties(struct, source, node_tree_map: Dict[NodeTree, NodeTree], skipped=NODE_PATCH_SKIPPED_PROPERTIES):
+    for prop in source.bl_rna.properties:
+        identifier = prop.identifier
+        if identifier in skipped or identifier.startswith("bl_"):
+            continue
+        if prop.type == 'POINTER':
+            value = getattr(source, identifier)
+            if prop.is_readonly:
+                if isinstance(value, bpy.types.ColorRamp):
+                    patch_color_ramp(getattr(struct, identifier), value)
+                elif isinstance(value, bpy.types.CurveMapping):
+                    patch_curve_mapping(getattr(struct, identifier), value)
+                elif value is not None:
+                    patch_rna_properties(getattr(struct, identifier), value, node_tree_map, skipped=("rna_type",))
+                continue
+            if isinstance(value, ID):
+                value = map_id(value, node_tree_map)
+            set_if_different(struct, identifier, value)
+        elif prop.type != 'COLLECTION' and not prop.is_readonly:
+            set_if_different(struct, identifier, getattr(source, identifier))
+
+def map_id(id_data: ID, node_tree_map: Dict[NodeTree, NodeTree]) -> Optional[ID]:
+    """Get the datablock of the current file standing in for a datablock of another file"""
+    if isinstance(id_data, NodeTree):
+        return node_tree_map.get(id_data)
+    return getattr(bpy.data, id_data.bl_rna.identifier.lower() + "s", {}).get(id_data.name)
+
+def get_socket(sockets, identifier: str):
+    for socket in sockets:
+        if socket.identifier == identifier:
+            return socket
+    return None
+
+def patch_node_tree(node_tree: NodeTree, source_tree: NodeTree, node_tree_map: Dict[NodeTree, NodeTree]) -> bool:
+    """Make a node tree match another one in place, only touching what differs
+
+    The node tree keeps its identity, so its users never need remapping and
+    nodes, links and values that did not change are never written.
+
+    Args:
+        node_tree (bpy.types.NodeTree): The node tree to patch
+        source_tree (bpy.types.NodeTree): The node tree to match, possibly from another file
+        node_tree_map (Dict[bpy.types.NodeTree, bpy.types.NodeTree]): Node trees of the current file
+            to use in place of the node groups used by source_tree
+
+    Returns:
+        bool: False, leaving node_tree untouched, if it cannot be patched because
+        its interface differs or a datablock used by source_tree is missing
+    """
+    if get_interface_signature(node_tree) != get_interface_signature(source_tree):
+        return False
+    for source_node in source_tree.nodes:
+        for prop in source_node.bl_rna.properties:
+            if prop.type == 'POINTER' and not prop.is_readonly:
+                value = getattr(source_node, prop.identifier)
+                if isinstance(value, ID) and map_id(value, node_tree_map) is None:
+                    return False
+
+    interface_items = {item.identifier: item for item in node_tree.interface.items_tree if item.item_type == 'SOCKET'}
+    for source_item in source_tree.interface.items_tree:
+        if source_item.item_type != 'SOCKET':
+            continue
+        item = interface_items[source_item.identifier]
+        for identifier in INTERFACE_SOCKET_PATCHED_PROPERTIES:
+            if hasattr(source_item, identifier):
+                set_if_different(item, identifier, getattr(source_item, identifier))
+
+    nodes = node_tree.nodes
+    source_nodes = {source_node.name: source_node for source_node in source_tree.nodes}
+    for node in list(nodes):
+        source_node = source_nodes.get(node.name)
+        if source_node is None or source_node.bl_idname != node.bl_idname:
+            nodes.remove(node)
+    for name, source_node in source_nodes.items():
+        if nodes.get(name) is None:
+            node = nodes.new(source_node.bl_idname)
+            node.name = name
+    invalidate_node_index(node_tree)
+
+    # Parents first, as attaching a node to a frame moves it
+    for name, source_node in source_nodes.items():
+        node = nodes[name]
+        parent = nodes.get(source_node.parent.name) if source_node.parent else None
+        if node.parent != parent:
+            node.parent = parent
+    for name, source_node in source_nodes.items():
+        node = nodes[name]
+        if getattr(source_node, "node_tree", None):
+            # Group sockets come from the node tree, so it has to be set before their values
+            set_if_different(node, "node_tree", node_tree_map[source_node.node_tree])
+        patch_rna_properties(node, source_node, node_tree_map)
+        for sockets, source_sockets in ((node.inputs, source_node.inputs), (node.outputs, source_node.outputs)):
+            for source_socket in source_sockets:
+                socket = get_socket(sockets, source_socket.identifier)
+                if socket and hasattr(source_socket, "default_value"):
+                    set_if_different(socket, "default_value", source_socket.default_value)
+
+    def get_link_key(link):
+        return (link.from_node.name, link.from_socket.identifier, link.to_node.name, link.to_socket.identifier)
+
+    links = {get_link_key(link): link for link in node_tree.links}
+    source_links = {get_link_key(link): link for link in source_tree.links}
+    for key, link in links.items():
+        if key not in source_links:
+            node_tree.links.remove(link)
+    for key, source_link in source_links.items():
+        link = links.get(key)
+        if link is None:
+            from_node_name, from_identifier, to_node_name, to_identifier = key
+            from_socket = get_socket(nodes[from_node_name].outputs, from_identifier)
+            to_socket = get_socket(nodes[to_node_name].inputs, to_identifier)
+            if not (from_socket and to_socket):
+                continue
+            link = node_tree.links.new(from_socket, to_socket)
+        set_if_different(link, "is_muted", source_link.is_muted)
+    return True
@@ -0,0 +1,259 @@
+import bpy
+import hashlib
+import numpy as np
+from bpy.app.handlers import persistent
+from bpy.types import Image, Node, NodeTree
+from typing import Optional
+from .common import find_node, find_nodes, get_rna_state, invalidate_node_index
+from .profiling import profiler
+
+ENVIRONMENT_NODETREE_NAME = "Environment Color"
+# View layer attribute the library's Environment Color reads the time of day from
+TIME_OF_DAY_ATTRIBUTE = "toon_shade.time_of_day"
+# Value node older Environment Color trees read the time of day from, replaced by the attribute when found
+TIME_OF_DAY_NODE_NAME = "Time Of Day"
+
+COLOR_RAMP_NODE_NAME = "Toon Shade Color Ramp"
+# The baked color ramp lookup table and the nodes sampling it in place of the ramp
+LUT_IMAGE_NAME = "Toon Shade Color Ramp LUT"
+LUT_NODE_NAME = "Toon Shade Color Ramp LUT"
+LUT_COORDINATE_NODE_NAME = "Toon Shade Color Ramp LUT Coordinate"
+LUT_RESOLUTION = 256
+# Custom property holding the hash of the color ramp a lookup table image was baked from
+LUT_HASH_PROPERTY = "toonshade_lut_hash"
+# Color ramp settings evaluated with NumPy, the others go through ColorRamp.evaluate
+NUMPY_RAMP_INTERPOLATIONS = {'LINEAR', 'CONSTANT', 'EASE'}
+
+def get_time_of_day_source(node_tree: NodeTree) -> Optional[Node]:
+    """Get the node a node tree reads the time of day from
+
+    Args:
+        node_tree (bpy.types.NodeTree): The Environment Color node tree
+
+    Returns:
+        bpy.types.Node: The view layer Attribute node, else the shared Value node, or None if there is neither
+    """
+    # Indexed by type only, the other node types have no attribute settings
+    for node in find_nodes(node_tree, {"bl_idname": "ShaderNodeAttribute"}):
+        if node.attribute_type == 'VIEW_LAYER' and node.attribute_name == TIME_OF_DAY_ATTRIBUTE:
+            return node
+    return find_node(node_tree, {"name": TIME_OF_DAY_NODE_NAME, "bl_idname": "ShaderNodeValue"})
+
+def use_view_layer_time_of_day(node_tree: NodeTree) -> bool:
+    """Make a node tree read the time of day of the view layer being rendered
+
+    The shared Value node older Environment Color trees read the time of day
+    from is replaced by a view layer Attribute node. One node tree then
+    renders every view layer at its own time of day, and changing or
+    animating the property needs no write into the node tree at all.
+
+    Args:
+        node_tree (bpy.types.NodeTree): The Environment Color node tree
+
+    Returns:
+        bool: Whether the node tree was changed
+    """
+    if node_tree.library:
+        return False
+    source = get_time_of_day_source(node_tree)
+    if source is None or source.bl_idname == "ShaderNodeAttribute":
+        return False
+    attribute_node = node_tree.nodes.new("ShaderNodeAttribute")
+    attribute_node.attribute_type = 'VIEW_LAYER'
+    attribute_node.attribute_name = TIME_OF_DAY_ATTRIBUTE
+    attribute_node.label = source.label
+    attribute_node.parent = source.parent
+    attribute_node.location = source.location
+    for link in list(source.outputs[0].links):
+        node_tree.links.new(attribute_node.outputs["Fac"], link.to_socket)
+    node_tree.nodes.remove(source)
+    attribute_node.name = TIME_OF_DAY_NODE_NAME
+    # One node replaced by another keeps the node count the index is checked against
+    invalidate_node_index(node_tree)
+    return True
+
+def ensure_view_layer_time_of_day() -> bool:
+    """Switch the Environment Color node tree of the file over to the view layer time of day, see use_view_layer_time_of_day"""
+    node_tree = bpy.data.node_groups.get(ENVIRONMENT_NODETREE_NAME)
+    return bool(node_tree) and use_view_layer_time_of_day(node_tree)
+
+def evaluate_color_ramp(color_ramp, positions: np.ndarray) -> np.ndarray:
+    """Evaluate a color ramp at many positions at once
+
+    Linear, constant and ease interpolation in RGB are vectorized with
+    NumPy. The other interpolations and color modes fall back to
+    ``ColorRamp.evaluate`` one position at a time.
+
+    Args:
+        color_ramp (bpy.types.ColorRamp): The color ramp
+        positions (np.ndarray): The positions to evaluate, 1D
+
+    Returns:
+        np.ndarray: The RGBA colors, one row per position
+    """
+    positions = np.asarray(positions, dtype=np.float32)
+    if color_ramp.color_mode != 'RGB' or color_ramp.interpolation not in NUMPY_RAMP_INTERPOLATIONS:
+        return np.array([color_ramp.evaluate(float(position)) for position in positions], dtype=np.float32)
+    elements = sorted(color_ramp.elements, key=lambda element: element.position)
+    stops = np.array([element.position for element in elements], dtype=np.float32)
+    colors = np.array([tuple(element.color) for element in elements], dtype=np.float32)
+    if len(elements) == 1:
+        return np.repeat(colors, len(positions), axis=0)
+    if color_ramp.interpolation == 'CONSTANT':
+        # The color of the last stop at or before each position, the first one before the ramp
+        return colors[np.clip(np.searchsorted(stops, positions, side='right') - 1, 0, None)]
+    right = np.clip(np.searchsorted(stops, positions, side='right'), 1, len(stops) - 1)
+    left = right - 1
+    span = stops[right] - stops[left]
+    # Clamping the factor also holds the first and last colors outside the ramp
+    factor = np.clip((positions - stops[left]) / np.where(span > 0, span, 1.0), 0.0, 1.0)
+    if color_ramp.interpolation == 'EASE':
+        factor = factor * factor * (3.0 - 2.0 * factor)
+    return colors[left] + (colors[right] - colors[left]) * factor[:, None]
+
+def get_color_ramp_hash(color_ramp) -> str:
+    return hashlib.sha1(repr(get_rna_state(color_ramp, {})).encode()).hexdigest()
+
+def bake_color_ramp_lut(node_tree: NodeTree, resolution: int = LUT_RESOLUTION) -> Optional[Image]:
+    """Bake the Toon Shade color ramp of a node tree into a 1D lookup table image
+
+    Texel centers are evaluated, so a linearly filtered lookup at a ramp
+    position matches the ramp. The image is packed, so renders elsewhere
+    do not need the addon to rebuild it.
+
+    Args:
+        node_tree (bpy.types.NodeTree): The Environment Color node tree
+        resolution (int): Width of the image
+
+    Returns:
+        bpy.types.Image: The lookup table image, or None if the node tree has no color ramp
+    """
+    ramp_node = find_node(node_tree, {"name": COLOR_RAMP_NODE_NAME})
+    if not ramp_node:
+        return None
+    colors = evaluate_color_ramp(ramp_node.color_ramp, (np.arange(resolution, dtype=np.float32) + 0.5) / resolution)
+
+    image = bpy.data.images.get(LUT_IMAGE_NAME)
+    if image is None:
+        image = bpy.data.images.new(LUT_IMAGE_NAME, resolution, 1, alpha=True, float_buffer=True)
+    elif tuple(image.size) != (resolution, 1):
+        image.scale(resolution, 1)
+    # The ramp colors are already scene linear
+    image.colorspace_settings.is_data = True
+    image.pixels.foreach_set(colors.ravel())
+    image.file_format = 'OPEN_EXR'
+    image.pack()
+    image[LUT_HASH_PROPERTY] = get_color_ramp_hash(ramp_node.color_ramp)
+    return image
+
+def get_lut_node(node_tree: NodeTree) -> Optional[Node]:
+    return find_node(node_tree, {"name": LUT_NODE_NAME})
+
+def relink_outputs(node_tree: NodeTree, from_node: Node, to_node: Node):
+    for output in from_node.outputs:
+        for link in list(output.links):
+            node_tree.links.new(to_node.outputs[output.name], link.to_socket)
+            node_tree.links.remove(link)
+
+def use_color_ramp_lut(node_tree: NodeTree) -> bool:
+    """Bake the Toon Shade color ramp and sample the lookup table in its place
+
+    The ramp node stays in the node tree, unconnected, so that it can still be
+    edited. Edits rebake the lookup table (see on_depsgraph_update_post).
+
+    Args:
+        node_tree (bpy.types.NodeTree): The Environment Color node tree
+
+    Returns:
+        bool: False if the node tree has no color ramp
+    """
+    ramp_node = find_node(node_tree, {"name": COLOR_RAMP_NODE_NAME})
+    image = bake_color_ramp_lut(node_tree)
+    if not ramp_node or not image:
+        return False
+    lut_node = get_lut_node(node_tree)
+    if lut_node is None:
+        lut_node = node_tree.nodes.new("ShaderNodeTexImage")
+        lut_node.name = LUT_NODE_NAME
+        lut_node.label = "Color Ramp LUT"
+        lut_node.location = (ramp_node.location.x, ramp_node.location.y - 300)
+    lut_node.image = image
+    lut_node.extension = 'EXTEND'
+    lut_node.interpolation = 'Closest' if ramp_node.color_ramp.interpolation == 'CONSTANT' else 'Linear'
+
+    coordinate_node = find_node(node_tree, {"name": LUT_COORDINATE_NODE_NAME})
+    if coordinate_node is None:
+        coordinate_node = node_tree.nodes.new("ShaderNodeCombineXYZ")
+        coordinate_node.name = LUT_COORDINATE_NODE_NAME
+        coordinate_node.label = "Color Ramp LUT Coordinate"
+        coordinate_node.location = (lut_node.location.x - 200, lut_node.location.y)
+    coordinate_node.inputs["Y"].default_value = 0.5
+    fac_input = ramp_node.inputs["Fac"]
+    if fac_input.links:
+        node_tree.links.new(fac_input.links[0].from_socket, coordinate_node.inputs["X"])
+    else:
+        coordinate_node.inputs["X"].default_value = fac_input.default_value
+    node_tree.links.new(coordinate_node.outputs["Vector"], lut_node.inputs["Vector"])
+    relink_outputs(node_tree, ramp_node, lut_node)
+    return True
+
+def remove_color_ramp_lut(node_tree: NodeTree):
+    """Connect the Toon Shade color ramp back in place of its lookup table"""
+    lut_node = get_lut_node(node_tree)
+    if lut_node is None:
+        return
+    ramp_node = find_node(node_tree, {"name": COLOR_RAMP_NODE_NAME})
+    if ramp_node:
+        relink_outputs(node_tree, lut_node, ramp_node)
+    node_tree.nodes.remove(lut_node)
+    coordinate_node = find_node(node_tree, {"name": LUT_COORDINATE_NODE_NAME})
+    if coordinate_node:
+        node_tree.nodes.remove(coordinate_node)
+
+def update_color_ramp_lut(node_tree: NodeTree) -> bool:
+    """Rebake the lookup table of a node tree if its color ramp changed since the last bake
+
+    Returns:
+        bool: Whether the lookup table was rebaked
+    """
+    lut_node = get_lut_node(node_tree)
+    ramp_node = find_node(node_tree, {"name": COLOR_RAMP_NODE_NAME})
+    if not lut_node or not ramp_node or not lut_node.image:
+        return False
+    if lut_node.image.get(LUT_HASH_PROPERTY) == get_color_ramp_hash(ramp_node.color_ramp):
+        return False
+    bake_color_ramp_lut(node_tree)
+    lut_node.interpolation = 'Closest' if ramp_node.color_ramp.interpolation == 'CONSTANT' else 'Linear'
+    return True
+
+@persistent
+def on_depsgraph_update_post(scene, depsgraph):
+    for update in depsgraph.updates:
+        if isinstance(update.id, NodeTree) and update.id.original.name == ENVIRONMENT_NODETREE_NAME:
+            node_tree = update.id.original
+            if not node_tree.library:
+                update_color_ramp_lut(node_tree)
+            return
+
+@persistent
+def on_load_post(*args):
+    ensure_view_layer_time_of_day()
+
+@persistent
+def on_frame_change_pre(scene, *args):
+    # Animated values reach the shaders through the view layer attribute, there
+    # is nothing to write per frame. Only Environment Color trees appended since
+    # the file was loaded may still read the static Value node.
+    with profiler.timed("time_of_day.frame_change"):
+        if ensure_view_layer_time_of_day():
+            profiler.count("time_of_day.conversions")
+
+def register():
+    bpy.app.handlers.depsgraph_update_post.append(on_depsgraph_update_post)
+    bpy.app.handlers.load_post.append(on_load_post)
+    bpy.app.handlers.frame_change_pre.append(on_frame_change_pre)
+
+def unregister():
+    bpy.app.handlers.frame_change_pre.remove(on_frame_change_pre)
+    bpy.app.handlers.load_post.remove(on_load_post)
+    bpy.app.handlers.depsgraph_update_post.remove(on_depsgraph_update_post)
@@ -0,0 +1,515 @@
+import numpy as np
+from bpy.types import Node, NodeSocket, NodeTree
+from typing import Callable, Dict, Optional
+from .environment import TIME_OF_DAY_ATTRIBUTE, evaluate_color_ramp
+
+# Sample name of the lighting a Shader to RGB node would return, normal · light for a diffuse shader.
+# Shader Info nodes derive their diffuse shading and half-lambert factor from it too
+LIGHT_SAMPLE = "light"
+# Sample name of the Cast Shadows and Self Shadows outputs of Shader Info nodes, 1 where unshadowed
+SHADOW_SAMPLE = "shadow"
+# Scene linear Rec. 709 luminance, used when a color is plugged into a float socket
+LUMINANCE_COEFFICIENTS = np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+
+# Value getters take the values computed so far in this evaluation and the samples
+Getter = Callable[[dict, Dict[str, np.ndarray]], np.ndarray]
+
+def safe_divide(a, b):
+    return np.where(b != 0, a / np.where(b != 0, b, 1.0), 0.0)
+
+def fract(a):
+    return a - np.floor(a)
+
+def ping_pong(a, scale):
+    return np.where(scale != 0, np.abs(fract(safe_divide(a - scale, scale * 2.0)) * scale * 2.0 - scale), 0.0)
+
+def wrap(a, maximum, minimum):
+    extent = maximum - minimum
+    return np.where(extent != 0, a - extent * np.floor(safe_divide(a - minimum, extent)), minimum)
+
+def smooth_minimum(a, b, distance):
+    h = safe_divide(np.maximum(distance - np.abs(a - b), 0.0), distance)
+    return np.minimum(a, b) - h * h * h * distance * (1.0 / 6.0)
+
+MATH_OPERATIONS = {
+    'ADD': lambda a, b, c: a + b,
+    'SUBTRACT': lambda a, b, c: a - b,
+    'MULTIPLY': lambda a, b, c: a * b,
+    'DIVIDE': lambda a, b, c: safe_divide(a, b),
+    'MULTIPLY_ADD': lambda a, b, c: a * b + c,
+    'POWER': lambda a, b, c: np.where((a >= 0) | (b == np.round(b)), np.power(a, b), 0.0),
+    'LOGARITHM': lambda a, b, c: np.where((a > 0) & (b > 0), np.log(np.maximum(a, 1e-30)) / np.log(np.where(b > 0, b, 2.0)), 0.0),
+    'SQRT': lambda a, b, c: np.sqrt(np.maximum(a, 0.0)),
+    'INVERSE_SQRT': lambda a, b, c: np.where(a > 0, 1.0 / np.sqrt(np.where(a > 0, a, 1.0)), 0.0),
+    'ABSOLUTE': lambda a, b, c: np.abs(a),
+    'EXPONENT': lambda a, b, c: np.exp(a),
+    'MINIMUM': lambda a, b, c: np.minimum(a, b),
+    'MAXIMUM': lambda a, b, c: np.maximum(a, b),
+    'LESS_THAN': lambda a, b, c: (a < b).astype(np.float32),
+    'GREATER_THAN': lambda a, b, c: (a > b).astype(np.float32),
+    'SIGN': lambda a, b, c: np.sign(a),
+    'COMPARE': lambda a, b, c: (np.abs(a - b) <= np.maximum(c, 1e-5)).astype(np.float32),
+    'ROUND': lambda a, b, c: np.floor(a + 0.5),
+    'FLOOR': lambda a, b, c: np.floor(a),
+    'CEIL': lambda a, b, c: np.ceil(a),
+    'TRUNC': lambda a, b, c: np.trunc(a),
+    'FRACT': lambda a, b, c: fract(a),
+    'MODULO': lambda a, b, c: np.where(b != 0, np.fmod(a, np.where(b != 0, b, 1.0)), 0.0),
+    'FLOORED_MODULO': lambda a, b, c: np.where(b != 0, a - np.floor(safe_divide(a, b)) * b, 0.0),
+    'SNAP': lambda a, b, c: np.floor(safe_divide(a, b)) * b,
+    'WRAP': lambda a, b, c: wrap(a, b, c),
+    'PINGPONG': lambda a, b, c: ping_pong(a, b),
+    'SMOOTH_MIN': lambda a, b, c: smooth_minimum(a, b, c),
+    'SMOOTH_MAX': lambda a, b, c: -smooth_minimum(-a, -b, c),
+    'SINE': lambda a, b, c: np.sin(a),
+    'COSINE': lambda a, b, c: np.cos(a),
+    'TANGENT': lambda a, b, c: np.tan(a),
+    'ARCSINE': lambda a, b, c: np.arcsin(np.clip(a, -1.0, 1.0)),
+    'ARCCOSINE': lambda a, b, c: np.arccos(np.clip(a, -1.0, 1.0)),
+    'ARCTANGENT': lambda a, b, c: np.arctan(a),
+    'ARCTAN2': lambda a, b, c: np.arctan2(a, b),
+    'SINH': lambda a, b, c: np.sinh(a),
+    'COSH': lambda a, b, c: np.cosh(a),
+    'TANH': lambda a, b, c: np.tanh(a),
+    'RADIANS': lambda a, b, c: np.radians(a),
+    'DEGREES': lambda a, b, c: np.degrees(a),
+}
+
+def dot(a, b):
+    return np.sum(a * b, axis=-1)
+
+def normalize(a):
+    return safe_divide(a, np.linalg.norm(a, axis=-1)[..., None])
+
+ZERO_VECTOR = np.zeros(3, dtype=np.float32)
+
+# Vector math operations by name, returning (vector, value), the output they do not set is zero
+VECTOR_MATH_OPERATIONS = {
+    'ADD': lambda a, b, c, scale: (a + b, 0.0),
+    'SUBTRACT': lambda a, b, c, scale: (a - b, 0.0),
+    'MULTIPLY': lambda a, b, c, scale: (a * b, 0.0),
+    'DIVIDE': lambda a, b, c, scale: (safe_divide(a, b), 0.0),
+    'MULTIPLY_ADD': lambda a, b, c, scale: (a * b + c, 0.0),
+    'CROSS_PRODUCT': lambda a, b, c, scale: (np.cross(a, b), 0.0),
+    'DOT_PRODUCT': lambda a, b, c, scale: (ZERO_VECTOR, dot(a, b)),
+    'DISTANCE': lambda a, b, c, scale: (ZERO_VECTOR, np.linalg.norm(a - b, axis=-1)),
+    'LENGTH': lambda a, b, c, scale: (ZERO_VECTOR, np.linalg.norm(a, axis=-1)),
+    'SCALE': lambda a, b, c, scale: (a * np.asarray(scale)[..., None], 0.0),
+    'NORMALIZE': lambda a, b, c, scale: (normalize(a), 0.0),
+    'ABSOLUTE': lambda a, b, c, scale: (np.abs(a), 0.0),
+    'MINIMUM': lambda a, b, c, scale: (np.minimum(a, b), 0.0),
+    'MAXIMUM': lambda a, b, c, scale: (np.maximum(a, b), 0.0),
+    'FLOOR': lambda a, b, c, scale: (np.floor(a), 0.0),
+    'CEIL': lambda a, b, c, scale: (np.ceil(a), 0.0),
+    'FRACTION': lambda a, b, c, scale: (fract(a), 0.0),
+}
+
+def mix(a, b, factor):
+    return a + (b - a) * factor
+
+def rgb_to_hsv(rgb):
+    maximum, minimum = rgb.max(axis=-1), rgb.min(axis=-1)
+    delta = maximum - minimum
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    hue = np.where(r == maximum, safe_divide(g - b, delta),
+                   np.where(g == maximum, 2.0 + safe_divide(b - r, delta), 4.0 + safe_divide(r - g, delta)))
+    return fract(hue / 6.0), safe_divide(delta, maximum), maximum
+
+def hsv_to_rgb(hue, saturation, value):
+    hue, saturation, value = np.broadcast_arrays(hue, saturation, value)
+    sector = np.floor(hue * 6.0)
+    f = hue * 6.0 - sector
+    p = value * (1.0 - saturation)
+    q = value * (1.0 - saturation * f)
+    t = value * (1.0 - saturation * (1.0 - f))
+    sector = np.mod(sector, 6.0)[..., None]
+    choices = [np.stack(channels, axis=-1) for channels in (
+        (value, t, p), (q, value, p), (p, value, t), (p, q, value), (t, p, value), (value, p, q))]
+    return np.select([sector == index for index in range(6)], choices)
+
+def blend_color(a, b, factor):
+    # Hue and saturation of the second color, value of the first one, as long as the second one has a hue
+    hue, saturation, _ = rgb_to_hsv(b)
+    colored = hsv_to_rgb(hue, saturation, rgb_to_hsv(a)[2])
+    return np.where(np.asarray(saturation)[..., None] != 0, mix(a, colored, factor), a)
+
+# RGB blend modes of the Mix node, with the factor already shaped for broadcasting
+BLEND_OPERATIONS = {
+    'MIX': lambda a, b, f: mix(a, b, f),
+    'ADD': lambda a, b, f: a + f * b,
+    'SUBTRACT': lambda a, b, f: a - f * b,
+    'MULTIPLY': lambda a, b, f: a * (1.0 - f + f * b),
+    'SCREEN': lambda a, b, f: 1.0 - (1.0 - f + f * (1.0 - b)) * (1.0 - a),
+    'DIVIDE': lambda a, b, f: np.where(b != 0, (1.0 - f) * a + f * safe_divide(a, b), a),
+    'DIFFERENCE': lambda a, b, f: mix(a, np.abs(a - b), f),
+    'DARKEN': lambda a, b, f: mix(a, np.minimum(a, b), f),
+    'LIGHTEN': lambda a, b, f: np.maximum(a, f * b),
+    'OVERLAY': lambda a, b, f: np.where(
+        a < 0.5, a * (1.0 - f + 2.0 * f * b), 1.0 - (1.0 - f + 2.0 * f * (1.0 - b)) * (1.0 - a)),
+    'COLOR': lambda a, b, f: blend_color(a, b, f),
+}
+
+def blend_colors(blend_type: str, a, b, factor, node: Node):
+    operation = BLEND_OPERATIONS.get(blend_type)
+    if operation is None:
+        raise ValueError(f"Cannot evaluate blend type {blend_type} of node {node.name}")
+    factor = np.asarray(factor)[..., None]
+    rgb = operation(a[..., :3], b[..., :3], factor)
+    # Blending leaves the alpha of the first color
+    return np.concatenate([rgb, np.broadcast_to(a[..., 3:], rgb.shape[:-1] + (1,))], axis=-1)
+
+def convert_value(value, from_type: str, to_type: str):
+    """Convert a value between socket types the way implicit conversions do in shaders"""
+    if from_type == to_type or to_type not in {'VALUE', 'INT', 'BOOLEAN', 'RGBA', 'VECTOR'}:
+        return value
+    if from_type in {'VALUE', 'INT', 'BOOLEAN'}:
+        if to_type == 'RGBA':
+            return np.stack([value, value, value, np.ones_like(value)], axis=-1)
+        if to_type == 'VECTOR':
+            return np.stack([value, value, value], axis=-1)
+        return value
+    if from_type == 'RGBA':
+        if to_type == 'VECTOR':
+            return value[..., :3]
+        return value[..., :3] @ LUMINANCE_COEFFICIENTS
+    if from_type == 'VECTOR':
+        if to_type == 'RGBA':
+            return np.concatenate([value, np.ones_like(value[..., :1])], axis=-1)
+        return value.mean(axis=-1)
+    return value
+
+def constant(value) -> Getter:
+    value = np.asarray(value, dtype=np.float32)
+    return lambda values, samples: value
+
+def get_group_output_node(node_tree: NodeTree) -> Optional[Node]:
+    outputs = [node for node in node_tree.nodes if node.bl_idname == "NodeGroupOutput"]
+    for node in outputs:
+        if node.is_active_output:
+            return node
+    return outputs[0] if outputs else None
+
+def get_socket_by_identifier(sockets, identifier: str) -> NodeSocket:
+    for socket in sockets:
+        if socket.identifier == identifier:
+            return socket
+    raise KeyError(identifier)
+
+class NodeTreeCompiler():
+    """Compiles the math, mix and color ramp subset of a shader node tree into NumPy getters.
+
+    Node groups are inlined, every node is evaluated once per batch however
+    many sockets read it.
+    """
+    def __init__(self):
+        self.node_getters = {}
+
+    def compile_input(self, node: Node, socket: NodeSocket, scope: tuple, group_inputs: Dict[str, Getter]) -> Getter:
+        links = [link for link in socket.links if not link.is_muted]
+        if not links:
+            if not hasattr(socket, "default_value"):
+                raise ValueError(f"Cannot evaluate unlinked input {socket.name} of node {node.name}")
+            return constant(tuple(socket.default_value) if socket.type in {'RGBA', 'VECTOR'} else socket.default_value)
+        link = links[0]
+        getter = self.compile_output(link.from_node, link.from_socket, scope, group_inputs)
+        from_type, to_type = link.from_socket.type, socket.type
+        if from_type == to_type:
+            return getter
+        return lambda values, samples: convert_value(getter(values, samples), from_type, to_type)
+
+    def compile_output(self, node: Node, socket: NodeSocket, scope: tuple, group_inputs: Dict[str, Getter]) -> Getter:
+        if node.bl_idname == "NodeGroupInput":
+            getter = group_inputs.get(socket.name)
+            if getter is None:
+                raise ValueError(f"No value for group input {socket.name}")
+            return getter
+        if node.bl_idname == "NodeReroute":
+            return self.compile_input(node, node.inputs[0], scope, group_inputs)
+        key = scope + (node.name,)
+        node_getter = self.node_getters.get(key)
+        if node_getter is None:
+            evaluate = self.compile_node(node, scope, group_inputs)
+
+            def node_getter(values, samples, key=key, evaluate=evaluate):
+                if key not in values:
+                    values[key] = evaluate(values, samples)
+                return values[key]
+            self.node_getters[key] = node_getter
+        identifier = socket.identifier
+        return lambda values, samples: node_getter(values, samples)[identifier]
+
+    def compile_node(self, node: Node, scope: tuple, group_inputs: Dict[str, Getter]):
+        """Compile a node into a function returning its output values by socket identifier"""
+        def get_input(index_or_identifier):
+            if isinstance(index_or_identifier, int):
+                socket = node.inputs[index_or_identifier]
+            else:
+                socket = get_socket_by_identifier(node.inputs, index_or_identifier)
+            return self.compile_input(node, socket, scope, group_inputs)
+
+        outputs = node.outputs
+        bl_idname = node.bl_idname
+        if node.mute:
+            passed = {
+                link.to_socket.identifier: self.compile_input(node, link.from_socket, scope, group_inputs)
+                for link in node.internal_links
+                }
+            zero = constant(0.0)
+            return lambda values, samples: {
+                output.identifier: passed.get(output.identifier, zero)(values, samples) for output in outputs
+                }
+
+        if bl_idname == "ShaderNodeGroup":
+            inner_tree = node.node_tree
+            output_node = get_group_output_node(inner_tree) if inner_tree else None
+            if output_node is None:
+                raise ValueError(f"Node group {node.name} has no output")
+            inner_inputs = {socket.name: get_input(socket.identifier) for socket in node.inputs if hasattr(socket, "default_value")}
+            inner_scope = scope + (node.name,)
+            inner_getters = {
+                output.identifier: self.compile_input(output_node, get_socket_by_identifier(output_node.inputs, output.identifier),
+                                                      inner_scope, inner_inputs)
+                for output in outputs
+                }
+            return lambda values, samples: {identifier: getter(values, samples) for identifier, getter in inner_getters.items()}
+
+        if bl_idname in {"ShaderNodeValue", "ShaderNodeRGB"}:
+            output = outputs[0]
+            value = constant(tuple(output.default_value) if output.type == 'RGBA' else output.default_value)
+            return lambda values, samples: {output.identifier: value(values, samples)}
+
+        if bl_idname == "ShaderNodeAttribute":
+            attribute_name = node.attribute_name
+
+            def evaluate_attribute(values, samples):
+                # Missing attributes read as zero in shaders
+                value = np.asarray(samples.get(attribute_name, 0.0), dtype=np.float32)
+                return {
+                    "Fac": value,
+                    "Color": convert_value(value, 'VALUE', 'RGBA'),
+                    "Vector": convert_value(value, 'VALUE', 'VECTOR'),
+                    "Alpha": np.ones_like(value),
+                }
+            return evaluate_attribute
+
+        if bl_idname == "ShaderNodeShaderToRGB":
+            def evaluate_light(values, samples):
+                value = np.asarray(samples.get(LIGHT_SAMPLE, 1.0), dtype=np.float32)
+                return {"Color": convert_value(value, 'VALUE', 'RGBA'), "Alpha": np.ones_like(value)}
+            return evaluate_light
+
+        if bl_idname == "ShaderNodeShaderInfo":
+            def evaluate_shader_info(values, samples):
+                light = np.asarray(samples.get(LIGHT_SAMPLE, 1.0), dtype=np.float32)
+                shadow = np.asarray(samples.get(SHADOW_SAMPLE, 1.0), dtype=np.float32)
+                # Without ambient light samples, only the lights are seen
+                return {
+                    "Diffuse Shading": convert_value(np.maximum(light, 0.0), 'VALUE', 'RGBA'),
+                    "Cast Shadows": shadow,
+                    "Self Shadows": shadow,
+                    "Ambient Lighting": np.array((0.0, 0.0, 0.0, 1.0), dtype=np.float32),
+                    "Half-lambert factor": light * 0.5 + 0.5,
+                }
+            return evaluate_shader_info
+
+        if bl_idname == "ShaderNodeMath":
+            operation = MATH_OPERATIONS.get(node.operation)
+            if operation is None:
+                raise ValueError(f"Cannot evaluate math operation {node.operation} of node {node.name}")
+            a, b, c = get_input(0), get_input(1), get_input(2)
+            use_clamp = node.use_clamp
+            identifier = outputs[0].identifier
+
+            def evaluate_math(values, samples):
+                with np.errstate(all='ignore'):
+                    result = operation(a(values, samples), b(values, samples), c(values, samples))
+                return {identifier: np.clip(result, 0.0, 1.0) if use_clamp else result}
+            return evaluate_math
+
+        if bl_idname == "ShaderNodeVectorMath":
+            operation = VECTOR_MATH_OPERATIONS.get(node.operation)
+            if operation is None:
+                raise ValueError(f"Cannot evaluate vector math operation {node.operation} of node {node.name}")
+            a, b, c, scale = get_input(0), get_input(1), get_input(2), get_input("Scale")
+
+            def evaluate_vector_math(values, samples):
+                with np.errstate(all='ignore'):
+                    vector, value = operation(a(values, samples), b(values, samples), c(values, samples), scale(values, samples))
+                return {"Vector": np.asarray(vector, dtype=np.float32), "Value": np.asarray(value, dtype=np.float32)}
+            return evaluate_vector_math
+
+        if bl_idname == "ShaderNodeMapRange":
+            if node.data_type != 'FLOAT':
+                raise ValueError(f"Cannot evaluate vector map range node {node.name}")
+            value, from_min, from_max, to_min, to_max, steps = (get_input(index) for index in range(6))
+            interpolation_type = node.interpolation_type
+            clamp = node.clamp and interpolation_type in {'LINEAR', 'STEPPED'}
+
+            def evaluate_map_range(values, samples):
+                low, high = to_min(values, samples), to_max(values, samples)
+                factor = safe_divide(value(values, samples) - from_min(values, samples),
+                                     from_max(values, samples) - from_min(values, samples))
+                if interpolation_type == 'STEPPED':
+                    step_count = steps(values, samples)
+                    factor = np.where(step_count > 0, np.floor(factor * (step_count + 1.0)) / np.where(step_count > 0, step_count, 1.0), 0.0)
+                elif interpolation_type == 'SMOOTHSTEP':
+                    factor = np.clip(factor, 0.0, 1.0)
+                    factor = factor * factor * (3.0 - 2.0 * factor)
+                elif interpolation_type == 'SMOOTHERSTEP':
+                    factor = np.clip(factor, 0.0, 1.0)
+                    factor = factor * factor * factor * (factor * (factor * 6.0 - 15.0) + 10.0)
+                result = low + factor * (high - low)
+                if clamp:
+                    result = np.clip(result, np.minimum(low, high), np.maximum(low, high))
+                return {"Result": result}
+            return evaluate_map_range
+
+        if bl_idname == "ShaderNodeClamp":
+            value, low, high = get_input(0), get_input(1), get_input(2)
+            is_range = node.clamp_type == 'RANGE'
+
+            def evaluate_clamp(values, samples):
+                minimum, maximum = low(values, samples), high(values, samples)
+                if is_range:
+                    minimum, maximum = np.minimum(minimum, maximum), np.maximum(minimum, maximum)
+                return {"Result": np.minimum(np.maximum(value(values, samples), minimum), maximum)}
+            return evaluate_clamp
+
+        if bl_idname == "ShaderNodeMix":
+            data_type = node.data_type
+            if data_type == 'FLOAT':
+                factor, a, b = get_input("Factor_Float"), get_input("A_Float"), get_input("B_Float")
+                output_identifier = "Result_Float"
+            elif data_type == 'RGBA':
+                factor, a, b = get_input("Factor_Float"), get_input("A_Color"), get_input("B_Color")
+                output_identifier = "Result_Color"
+            elif data_type == 'VECTOR' and node.factor_mode == 'UNIFORM':
+                factor, a, b = get_input("Factor_Float"), get_input("A_Vector"), get_input("B_Vector")
+                output_identifier = "Result_Vector"
+            else:
+                raise ValueError(f"Cannot evaluate {data_type} mix node {node.name}")
+            blend_type, clamp_factor, clamp_result = node.blend_type, node.clamp_factor, node.clamp_result
+
+            def evaluate_mix(values, samples):
+                f = factor(values, samples)
+                if clamp_factor:
+                    f = np.clip(f, 0.0, 1.0)
+                if data_type == 'RGBA':
+                    result = blend_colors(blend_type, a(values, samples), b(values, samples), f, node)
+                    if clamp_result:
+                        result = np.clip(result, 0.0, 1.0)
+                elif data_type == 'VECTOR':
+                    result = mix(a(values, samples), b(values, samples), np.asarray(f)[..., None])
+                else:
+                    result = mix(a(values, samples), b(values, samples), f)
+                return {output_identifier: result}
+            return evaluate_mix
+
+        if bl_idname == "ShaderNodeMixRGB":
+            factor, a, b = get_input(0), get_input(1), get_input(2)
+            blend_type, use_clamp = node.blend_type, node.use_clamp
+
+            def evaluate_mix_rgb(values, samples):
+                result = blend_colors(blend_type, a(values, samples), b(values, samples), factor(values, samples), node)
+                return {"Color": np.clip(result, 0.0, 1.0) if use_clamp else result}
+            return evaluate_mix_rgb
+
+        if bl_idname == "ShaderNodeValToRGB":
+            factor = get_input(0)
+            color_ramp = node.color_ramp
+
+            def evaluate_color_ramp_node(values, samples):
+                f = np.asarray(factor(values, samples), dtype=np.float32)
+                colors = evaluate_color_ramp(color_ramp, f.ravel()).reshape(f.shape + (4,))
+                return {"Color": colors, "Alpha": colors[..., 3]}
+            return evaluate_color_ramp_node
+
+        if bl_idname == "ShaderNodeRGBToBW":
+            color = get_input(0)
+            return lambda values, samples: {"Val": convert_value(color(values, samples), 'RGBA', 'VALUE')}
+
+        if bl_idname == "ShaderNodeInvert":
+            factor, color = get_input(0), get_input(1)
+
+            def evaluate_invert(values, samples):
+                c = color(values, samples)
+                rgb = mix(c[..., :3], 1.0 - c[..., :3], np.asarray(factor(values, samples))[..., None])
+                return {"Color": np.concatenate([rgb, np.broadcast_to(c[..., 3:], rgb.shape[:-1] + (1,))], axis=-1)}
+            return evaluate_invert
+
+        if bl_idname == "ShaderNodeSeparateColor" and node.mode in {'RGB', 'HSV'}:
+            color = get_input(0)
+            use_hsv = node.mode == 'HSV'
+
+            def evaluate_separate_color(values, samples):
+                c = color(values, samples)
+                channels = rgb_to_hsv(c[..., :3]) if use_hsv else (c[..., 0], c[..., 1], c[..., 2])
+                return {output.identifier: channel for output, channel in zip(outputs, channels)}
+            return evaluate_separate_color
+
+        if bl_idname == "ShaderNodeCombineColor" and node.mode in {'RGB', 'HSV'}:
+            red, green, blue = get_input(0), get_input(1), get_input(2)
+            use_hsv = node.mode == 'HSV'
+
+            def evaluate_combine_color(values, samples):
+                r, g, b = np.broadcast_arrays(red(values, samples), green(values, samples), blue(values, samples))
+                rgb = hsv_to_rgb(r, g, b) if use_hsv else np.stack([r, g, b], axis=-1)
+                return {"Color": np.concatenate([rgb, np.ones_like(rgb[..., :1])], axis=-1)}
+            return evaluate_combine_color
+
+        raise ValueError(f"Cannot evaluate node {node.name} ({bl_idname})")
+
+class NodeTreeEvaluator():
+    """Vectorized CPU evaluation of one output of a Toon Shade node group.
+
+    Samples are arrays of the same length, by name: group input names,
+    attribute names (TIME_OF_DAY_ATTRIBUTE for the view layer time of day),
+    LIGHT_SAMPLE for the lighting Shader to RGB and Shader Info nodes would
+    return and SHADOW_SAMPLE for the shadows of Shader Info nodes. Unlinked
+    group inputs without a sample use their default value.
+
+    Raises ValueError when the output depends on a node outside the supported
+    math, mix and color ramp subset.
+    """
+    def __init__(self, node_tree: NodeTree, output_name: str = None):
+        output_node = get_group_output_node(node_tree)
+        if output_node is None:
+            raise ValueError(f"Node group {node_tree.name} has no output")
+        sockets = [socket for socket in output_node.inputs if hasattr(socket, "default_value")]
+        socket = next((socket for socket in sockets if output_name in (None, socket.name)), None)
+        if socket is None:
+            raise ValueError(f"Node group {node_tree.name} has no output {output_name}")
+        self.output_type = socket.type
+        group_inputs = {}
+        for item in node_tree.interface.items_tree:
+            if item.item_type != 'SOCKET' or item.in_out != 'INPUT' or not hasattr(item, "default_value"):
+                continue
+            default = tuple(item.default_value) if item.socket_type in {"NodeSocketColor", "NodeSocketVector"} else item.default_value
+            group_inputs[item.name] = self.get_sample_getter(item.name, default)
+        self.getter = NodeTreeCompiler().compile_input(output_node, socket, (), group_inputs)
+
+    @staticmethod
+    def get_sample_getter(name: str, default) -> Getter:
+        default = np.asarray(default, dtype=np.float32)
+        return lambda values, samples: np.asarray(samples[name], dtype=np.float32) if name in samples else default
+
+    def __call__(self, samples: Dict[str, np.ndarray]) -> np.ndarray:
+        count = max((np.size(value) for value in samples.values()), default=1)
+        result = np.asarray(self.getter({}, samples), dtype=np.float32)
+        shape = (count, 4) if self.output_type == 'RGBA' else (count, 3) if self.output_type == 'VECTOR' else (count,)
+        return np.broadcast_to(result, shape)
+
+def evaluate_toonshade_samples(node_tree: NodeTree, light, time_of_day, output_name: str = None) -> np.ndarray:
+    """Evaluate a Toon Shade node group for a batch of (normal · light, time of day) samples
+
+    Args:
+        node_tree (bpy.types.NodeTree): The node group
+        light (np.ndarray): Normal · light of every sample
+        time_of_day (np.ndarray): Time of day of every sample
+        output_name (str, optional): The output to evaluate. Defaults to the first one
+
+    Returns:
+        np.ndarray: One value or RGBA color per sample
+    """
+    samples = {LIGHT_SAMPLE: light, TIME_OF_DAY_ATTRIBUTE: time_of_day, "Time Of Day": time_of_day}
+    return NodeTreeEvaluator(node_tree, output_name)(samples)
@@ -0,0 +1,480 @@
+import bpy
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from bpy.app.handlers import persistent
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from .common import get_addon_filepath, get_node_tree_hash
+
+LIBRARY_FILE_NAME = "library.blend"
+MANIFEST_FILE_NAME = "library.json"
+# 2: the manifest is checked against the library size and hash, so one built elsewhere stays valid for the same library
+MANIFEST_VERSION = 2
+# Custom property holding the manifest hash of the library version a node group was appended from
+LIBRARY_HASH_PROPERTY = "toonshade_library_hash"
+# Directory next to the library holding one .blend file per top-level node group
+SPLIT_LIBRARY_DIRECTORY_NAME = "library_split"
+SPLIT_MANIFEST_FILE_NAME = "manifest.json"
+
+# Seconds to wait after startup or a file load before prewarming, to stay out of the way of the UI
+PREWARM_DELAY = 2.0
+PREWARM_CHUNK_SIZE = 1 << 20
+# Suffix of the file next to a cached library copy recording the source it was copied from
+LIBRARY_CACHE_STAMP_SUFFIX = ".stamp.json"
+
+# The last manifest read or built, with the library stamp it was checked against
+_manifest_cache = (None, None)
+# The last library hash, with the library stamp it was computed for
+_library_hash_cache = (None, None)
+
+def get_library_filepath() -> str:
+    return get_addon_filepath() + LIBRARY_FILE_NAME
+
+def get_manifest_filepath(library_filepath: str = None) -> str:
+    library_filepath = library_filepath or get_library_filepath()
+    return os.path.join(os.path.dirname(library_filepath), MANIFEST_FILE_NAME)
+
+def get_file_stamp(filepath: str) -> Optional[dict]:
+    """Get the size and modification time of a file, or None if it does not exist"""
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+def get_file_hash(filepath: str) -> Optional[str]:
+    """Get the SHA-1 of a file, or None if it cannot be read"""
+    file_hash = hashlib.sha1()
+    try:
+        with open(filepath, "rb") as f:
+            while chunk := f.read(PREWARM_CHUNK_SIZE):
+                file_hash.update(chunk)
+    except OSError:
+        return None
+    return file_hash.hexdigest()
+
+def get_library_hash(library_filepath: str, stamp: dict) -> Optional[str]:
+    """Get the SHA-1 of a library file, hashing it once per session and modification time"""
+    global _library_hash_cache
+    key = (library_filepath, stamp["size"], stamp["mtime"])
+    if _library_hash_cache[0] != key:
+        _library_hash_cache = (key, get_file_hash(library_filepath))
+    return _library_hash_cache[1]
+
+def get_library_cache_directory() -> str:
+    """Get the local directory library files are cached in, or an empty string if caching is off"""
+    addon = bpy.context.preferences.addons.get(__package__)
+    if not addon or not addon.preferences.library_cache_directory:
+        return ""
+    return bpy.path.abspath(addon.preferences.library_cache_directory)
+
+def get_cached_library_filepath(filepath: str, cache_directory: str = None) -> str:
+    """Get the local copy of a library file, copying or refreshing it first if needed
+
+    The copy is only refreshed when the size or modification time of the
+    source changed and its content hash differs from the one of the copy, so
+    a touched but identical library is not copied again. The source is read
+    once, hashed while being copied.
+
+    Args:
+        filepath (str): The library file
+        cache_directory (str, optional): The cache directory. Defaults to the one set in the preferences
+
+    Returns:
+        str: The cached copy, or the library file itself if caching is off or failed
+    """
+    if cache_directory is None:
+        cache_directory = get_library_cache_directory()
+    source_stamp = get_file_stamp(filepath)
+    if not cache_directory or source_stamp is None:
+        return filepath
+    # Split library files keep their subdirectory, so they do not collide with the monolithic one
+    relative_filepath = os.path.relpath(filepath, os.path.dirname(get_library_filepath()))
+    if relative_filepath.startswith(os.pardir):
+        relative_filepath = os.path.basename(filepath)
+    cached_filepath = os.path.join(cache_directory, relative_filepath)
+    stamp_filepath = cached_filepath + LIBRARY_CACHE_STAMP_SUFFIX
+    try:
+        with open(stamp_filepath, encoding="utf-8") as f:
+            cached_stamp = json.load(f)
+    except (OSError, ValueError):
+        cached_stamp = {}
+    is_cached = os.path.isfile(cached_filepath)
+    if (is_cached
+            and cached_stamp.get("size") == source_stamp["size"]
+            and cached_stamp.get("mtime") == source_stamp["mtime"]):
+        return cached_filepath
+
+    try:
+        os.makedirs(os.path.dirname(cached_filepath), exist_ok=True)
+        file_hash = hashlib.sha1()
+        fd, temp_filepath = tempfile.mkstemp(dir=os.path.dirname(cached_filepath))
+        try:
+            with open(filepath, "rb") as source, os.fdopen(fd, "wb") as target:
+                while chunk := source.read(PREWARM_CHUNK_SIZE):
+                    file_hash.update(chunk)
+                    target.write(chunk)
+            if is_cached and cached_stamp.get("hash") == file_hash.hexdigest():
+                os.remove(temp_filepath)
+            else:
+                print(f"Caching library {filepath} in {cache_directory}")
+                # Atomic, so a load or a prewarm thread never sees a partial copy
+                os.replace(temp_filepath, cached_filepath)
+        except BaseException:
+            if os.path.exists(temp_filepath):
+                os.remove(temp_filepath)
+            raise
+        with open(stamp_filepath, "w", encoding="utf-8") as f:
+            json.dump({**source_stamp, "hash": file_hash.hexdigest()}, f)
+    except OSError as e:
+        print(f"Could not cache library {filepath}: {e}")
+        return filepath
+    return cached_filepath
+
+def get_library_link_filepath(filepath: str) -> str:
+    """Get the path linked libraries should point to, relative to the blend file if Blender is set to use relative paths"""
+    if bpy.context.preferences.filepaths.use_relative_paths and bpy.data.is_saved:
+        try:
+            return bpy.path.relpath(filepath)
+        except ValueError:
+            # On another drive
+            pass
+    return filepath
+
+@contextmanager
+def load_library_file(filepath: str, link: bool = False, data=None):
+    """Load from a library file through its local cached copy, like ``bpy.data.libraries.load``
+
+    Libraries linked from the cached copy are pointed back at the library
+    file itself, so the saved file does not depend on the local cache and
+    still resolves on other machines.
+
+    Args:
+        filepath (str): The library file
+        link (bool): Whether to link the data
+        data (optional): The data to load into, ``bpy.data`` or temporary data. Defaults to ``bpy.data``
+
+    Yields:
+        The ``(lib_file, current_file)`` pair of ``bpy.data.libraries.load``
+    """
+    data = data or bpy.data
+    load_filepath = get_cached_library_filepath(filepath)
+    if not link:
+        with data.libraries.load(load_filepath) as data_pair:
+            yield data_pair
+        return
+    if load_filepath == filepath:
+        with data.libraries.load(filepath, link=True, relative=bpy.context.preferences.filepaths.use_relative_paths) as data_pair:
+            yield data_pair
+        return
+
+    def is_library_of(library, library_filepath):
+        return os.path.normpath(bpy.path.abspath(library.filepath)) == os.path.normpath(library_filepath)
+
+    # Point the library linked before at the cached copy for the load, so that Blender reuses it instead of adding another
+    for library in data.libraries:
+        if is_library_of(library, filepath):
+            library.filepath = load_filepath
+    try:
+        with data.libraries.load(load_filepath, link=True) as data_pair:
+            yield data_pair
+    finally:
+        link_filepath = get_library_link_filepath(filepath)
+        for library in data.libraries:
+            if is_library_of(library, load_filepath):
+                library.filepath = link_filepath
+
+def describe_node_group(node_group: bpy.types.NodeTree, hashes: dict) -> dict:
+    return {
+        "name": node_group.name,
+        "bl_idname": node_group.bl_idname,
+        "interface": [
+            {
+                "name": item.name,
+                "identifier": item.identifier,
+                "in_out": item.in_out,
+                "socket_type": item.socket_type,
+            }
+            for item in node_group.interface.items_tree if item.item_type == 'SOCKET'
+            ],
+        "dependencies": sorted({
+            node.node_tree.name for node in node_group.nodes
+            if getattr(node, "node_tree", None)
+            }),
+        "hash": get_node_tree_hash(node_group, hashes),
+    }
+
+def build_library_manifest(library_filepath: str = None) -> dict:
+    """Open the library once and describe all of its node groups
+
+    The library is loaded into temporary data, so nothing is added to the current file.
+
+    Args:
+        library_filepath (str, optional): The library file. Defaults to the bundled library
+
+    Returns:
+        dict: The manifest
+    """
+    library_filepath = library_filepath or get_library_filepath()
+    stamp = get_file_stamp(library_filepath)
+    file_hash = get_file_hash(library_filepath)
+    with bpy.data.temp_data() as temp_data:
+        with load_library_file(library_filepath, data=temp_data) as (lib_file, temp_file):
+            temp_file.node_groups = lib_file.node_groups
+        hashes = {}
+        node_groups = {
+            node_group.name: describe_node_group(node_group, hashes)
+            for node_group in temp_data.node_groups
+            }
+    return {
+        "version": MANIFEST_VERSION,
+        # Modification times change on every install, the content does not
+        "library": {"name": os.path.basename(library_filepath), "size": stamp and stamp["size"], "sha1": file_hash},
+        "node_groups": node_groups,
+    }
+
+def write_library_manifest(manifest: dict, library_filepath: str = None):
+    manifest_filepath = get_manifest_filepath(library_filepath)
+    try:
+        with open(manifest_filepath, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+    except OSError as e:
+        # The addon may be installed somewhere read-only, the manifest then only lives in memory
+        print(f"Could not write library manifest {manifest_filepath}: {e}")
+
+def read_library_manifest(library_filepath: str, stamp: dict) -> Optional[dict]:
+    """Read the manifest file, checking its version and library size but not the library hash"""
+    try:
+        with open(get_manifest_filepath(library_filepath), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("library", {}).get("size") != stamp["size"]:
+        return None
+    return manifest
+
+def check_library_manifest(library_filepath: str, stamp: dict, manifest: dict) -> Optional[dict]:
+    """Check a manifest read by read_library_manifest against the library hash, and keep it if it matches"""
+    global _manifest_cache
+    if manifest["library"].get("sha1") != get_library_hash(library_filepath, stamp):
+        return None
+    _manifest_cache = ((library_filepath, stamp["size"], stamp["mtime"]), manifest)
+    return manifest
+
+def load_library_manifest(library_filepath: str = None) -> Optional[dict]:
+    """Get the manifest of the library if it is up to date, without opening the library
+
+    The manifest is checked against the size and content hash of the library,
+    so a prebuilt one (see tools/build_library_manifest.py) stays valid
+    wherever the addon is installed. The library is hashed once per session
+    and modification time.
+
+    Args:
+        library_filepath (str, optional): The library file. Defaults to the bundled library
+
+    Returns:
+        dict: The manifest, or None if it is missing or does not match the library file
+    """
+    library_filepath = library_filepath or get_library_filepath()
+    stamp = get_file_stamp(library_filepath)
+    if stamp is None:
+        return None
+    cached_key, cached_manifest = _manifest_cache
+    if cached_key == (library_filepath, stamp["size"], stamp["mtime"]):
+        return cached_manifest
+    manifest = read_library_manifest(library_filepath, stamp)
+    return manifest and check_library_manifest(library_filepath, stamp, manifest)
+
+def get_library_manifest(library_filepath: str = None) -> dict:
+    """Get the manifest of the library, rebuilding it if it is missing or stale"""
+    global _manifest_cache
+    library_filepath = library_filepath or get_library_filepath()
+    manifest = load_library_manifest(library_filepath)
+    if manifest is None:
+        print(f"Building library manifest for {library_filepath}")
+        manifest = build_library_manifest(library_filepath)
+        write_library_manifest(manifest, library_filepath)
+        stamp = get_file_stamp(library_filepath) or {}
+        _manifest_cache = ((library_filepath, stamp.get("size"), stamp.get("mtime")), manifest)
+    return manifest
+
+def get_split_library_directory(library_filepath: str = None) -> str:
+    library_filepath = library_filepath or get_library_filepath()
+    return os.path.join(os.path.dirname(library_filepath), SPLIT_LIBRARY_DIRECTORY_NAME)
+
+def split_library(library_filepath: str = None) -> dict:
+    """Build step writing one .blend file per top-level node group of the library
+
+    Every file also holds the nested node groups of its group. The manifest
+    written next to them tells which file to load each node group from, and
+    is stamped with the library it was split from.
+
+    Args:
+        library_filepath (str, optional): The library file. Defaults to the bundled library
+
+    Returns:
+        dict: The split manifest
+    """
+    library_filepath = library_filepath or get_library_filepath()
+    split_directory = get_split_library_directory(library_filepath)
+    os.makedirs(split_directory, exist_ok=True)
+
+    with bpy.data.temp_data() as temp_data:
+        with temp_data.libraries.load(library_filepath) as (lib_file, temp_file):
+            temp_file.node_groups = lib_file.node_groups
+        node_groups = {node_group.name: node_group for node_group in temp_data.node_groups}
+        dependencies = {
+            name: sorted({node.node_tree.name for node in node_group.nodes if getattr(node, "node_tree", None)})
+            for name, node_group in node_groups.items()
+            }
+
+        def get_all_dependencies(name, found):
+            for dependency in dependencies.get(name, []):
+                if dependency not in found:
+                    found.add(dependency)
+                    get_all_dependencies(dependency, found)
+            return found
+
+        nested_names = {dependency for names in dependencies.values() for dependency in names}
+        files = {}
+        node_group_files = {}
+        for name in sorted(node_groups):
+            if name in nested_names:
+                continue
+            filename = bpy.path.clean_name(name) + ".blend"
+            temp_data.libraries.write(os.path.join(split_directory, filename), {node_groups[name]}, fake_user=True)
+            contents = sorted(get_all_dependencies(name, {name}))
+            files[filename] = contents
+            node_group_files[name] = filename
+        # Nested node groups are loaded from the smallest file holding them
+        for filename, contents in sorted(files.items(), key=lambda item: len(item[1])):
+            for name in contents:
+                node_group_files.setdefault(name, filename)
+
+    stamp = get_file_stamp(library_filepath)
+    manifest = {
+        "version": MANIFEST_VERSION,
+        # Like the library manifest, so the split files stay valid for the same library wherever it is installed
+        "library": {
+            "name": os.path.basename(library_filepath),
+            "size": stamp and stamp["size"],
+            "sha1": stamp and get_library_hash(library_filepath, stamp),
+            },
+        "files": files,
+        "node_groups": node_group_files,
+        "dependencies": dependencies,
+    }
+    with open(os.path.join(split_directory, SPLIT_MANIFEST_FILE_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+def load_split_library_manifest(library_filepath: str = None) -> Optional[dict]:
+    """Get the manifest of the split library, or None if there is none or it was split from another library version"""
+    library_filepath = library_filepath or get_library_filepath()
+    stamp = get_file_stamp(library_filepath)
+    try:
+        with open(os.path.join(get_split_library_directory(library_filepath), SPLIT_MANIFEST_FILE_NAME), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    library = manifest.get("library", {})
+    if (stamp is None
+            or manifest.get("version") != MANIFEST_VERSION
+            or library.get("size") != stamp["size"]
+            or library.get("sha1") != get_library_hash(library_filepath, stamp)):
+        return None
+    return manifest
+
+def get_library_sources(tree_names, library_filepath: str = None) -> Dict[str, List[str]]:
+    """Get the library files to load node groups from
+
+    Uses the split library when it is up to date and has every node group,
+    so only the files a request needs are opened. Falls back to the monolithic library otherwise.
+    Only for appending or reading into temporary data: the split files are
+    an optional build output that may be missing or rebuilt, so nothing may
+    stay linked to them.
+
+    Args:
+        tree_names (Iterable[str]): Names of the node groups
+        library_filepath (str, optional): The library file. Defaults to the bundled library
+
+    Returns:
+        Dict[str, List[str]]: The node group names to load, by library file
+    """
+    library_filepath = library_filepath or get_library_filepath()
+    tree_names = list(tree_names)
+    split_manifest = load_split_library_manifest(library_filepath)
+    if split_manifest is None:
+        return {library_filepath: tree_names}
+    split_directory = get_split_library_directory(library_filepath)
+    sources = {}
+    for tree_name in tree_names:
+        filename = split_manifest["node_groups"].get(tree_name)
+        filepath = os.path.join(split_directory, filename) if filename else None
+        if not filepath or not os.path.isfile(filepath):
+            return {library_filepath: tree_names}
+        sources.setdefault(filepath, []).append(tree_name)
+    return sources
+
+def read_file_into_page_cache(filepath: str, cache_directory: str = ""):
+    # Copying the library into the local cache reads it too
+    if cache_directory:
+        get_cached_library_filepath(filepath, cache_directory)
+        return
+    try:
+        with open(filepath, "rb", buffering=0) as f:
+            while f.read(PREWARM_CHUNK_SIZE):
+                pass
+    except OSError as e:
+        print(f"Could not prewarm {filepath}: {e}")
+
+def prewarm_library_file(library_filepath: str, cache_directory: str, stamp: dict, manifest: Optional[dict]):
+    read_file_into_page_cache(library_filepath, cache_directory)
+    # Hashed from the page cache here, so the first manifest lookup on the main thread finds it checked
+    if manifest is not None:
+        check_library_manifest(library_filepath, stamp, manifest)
+
+def prewarm_library():
+    """Timer callback preparing the library for the first insert of the session
+
+    Only reads the manifest file on the main thread. A background thread then
+    reads the library file so that it sits in the OS page cache, or refreshes
+    its local cached copy if a cache directory is set, and hashes it to check
+    the manifest. A missing or stale manifest is left for the first insert to
+    rebuild, opening the library from a timer would block the UI.
+    """
+    addon = bpy.context.preferences.addons.get(__package__)
+    if addon and not addon.preferences.use_library_prewarm:
+        return None
+    library_filepath = get_library_filepath()
+    stamp = get_file_stamp(library_filepath)
+    if stamp is None:
+        return None
+    manifest = None
+    if _manifest_cache[0] != (library_filepath, stamp["size"], stamp["mtime"]):
+        manifest = read_library_manifest(library_filepath, stamp)
+    cache_directory = get_library_cache_directory()
+    threading.Thread(
+        target=prewarm_library_file, args=(library_filepath, cache_directory, stamp, manifest), daemon=True
+        ).start()
+    return None
+
+def schedule_library_prewarm():
+    if not bpy.app.timers.is_registered(prewarm_library):
+        bpy.app.timers.register(prewarm_library, first_interval=PREWARM_DELAY)
+
+@persistent
+def on_load_post(*args):
+    schedule_library_prewarm()
+
+def register():
+    bpy.app.handlers.load_post.append(on_load_post)
+    schedule_library_prewarm()
+
+def unregister():
+    if bpy.app.timers.is_registered(prewarm_library):
+        bpy.app.timers.unregister(prewarm_library)
+    bpy.app.handlers.load_post.remove(on_load_post)
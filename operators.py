@@ -2,8 +2,12 @@ import bpy
 from bpy.types import Operator
 from bpy.utils import register_classes_factory
 from bpy.props import StringProperty, PointerProperty, BoolProperty
-from .properties import ToonShade
+from .properties import ToonShade, merge_duplicate_nodegroups
 from .nodeOrganizer import NodeOrganizer
+from .usage import usage_index
+from .profiling import profiler
+from .library import split_library
+from .environment import ENVIRONMENT_NODETREE_NAME, use_color_ramp_lut, remove_color_ramp_lut
 
 
 class TOONSHADE_OT_ImportNodeTrees(Operator):
@@ -123,7 +127,9 @@ class TOONSHADE_OT_AddNodeTree(Operator):
 
     def execute(self, context):
         ts = ToonShade(context)
-        node_tree = ts.get_nodetree_from_library(self.node_tree_name, force_reload=True, link=self.link)
+        # Only reload when the node group in the file differs from the library version
+        force_reload = not ts.is_nodetree_up_to_date(self.node_tree_name, link=self.link)
+        node_tree = ts.get_nodetree_from_library(self.node_tree_name, force_reload=force_reload, link=self.link, in_place=True)
         if not node_tree:
             self.report({'ERROR'}, "No node tree found")
             return {'CANCELLED'}
@@ -134,10 +140,130 @@ class TOONSHADE_OT_AddNodeTree(Operator):
                               )
         return {'FINISHED'}
 
+class TOONSHADE_OT_SelectUsers(Operator):
+    """Select the objects using a Toon Shade node tree"""
+    bl_idname = "toonshade.select_users"
+    bl_label = "Select Toon Shade Users"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    node_tree_name: StringProperty(
+        name="Node Tree Name",
+        description="Name of the Toon Shade node tree to select the users of",
+        default=""
+    )
+
+    def execute(self, context):
+        objects = usage_index.objects_using(self.node_tree_name)
+        if not objects:
+            self.report({'WARNING'}, f"No objects use {self.node_tree_name}")
+            return {'CANCELLED'}
+        selected = 0
+        for obj in objects:
+            try:
+                obj.select_set(True, view_layer=context.view_layer)
+            except RuntimeError:
+                # Not in this view layer
+                continue
+            selected += 1
+        self.report({'INFO'}, f"Selected {selected} objects using {self.node_tree_name}")
+        return {'FINISHED'}
+
+class TOONSHADE_OT_MergeDuplicateNodeGroups(Operator):
+    """Merge node groups with identical contents, whatever their names"""
+    bl_idname = "toonshade.merge_duplicate_node_groups"
+    bl_label = "Merge Duplicate Node Groups"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    dry_run: BoolProperty(
+        name="Dry Run",
+        description="Only report what would be merged",
+        default=True
+    )
+
+    def execute(self, context):
+        report = merge_duplicate_nodegroups(dry_run=self.dry_run)
+        if not report["node_groups"]:
+            self.report({'INFO'}, "No duplicate node groups found")
+            return {'FINISHED'}
+        for kept_name, duplicate_names in report["merged"].items():
+            print(f"{kept_name} <- {', '.join(duplicate_names)}")
+        verb = "Would merge" if self.dry_run else "Merged"
+        self.report({'INFO'}, f"{verb} {report['node_groups']} node groups, saving {report['nodes']} nodes, "
+                              f"{report['links']} links and {report['bytes'] / 1024:.1f} KiB")
+        return {'FINISHED'}
+
+class TOONSHADE_OT_SplitLibrary(Operator):
+    """Write one library file per top-level node group, so inserting a node only reads the file it needs"""
+    bl_idname = "toonshade.split_library"
+    bl_label = "Split Node Group Library"
+
+    def execute(self, context):
+        try:
+            manifest = split_library()
+        except OSError as e:
+            self.report({'ERROR'}, f"Could not split the library: {e}")
+            return {'CANCELLED'}
+        self.report({'INFO'}, f"Split the library into {len(manifest['files'])} files")
+        return {'FINISHED'}
+
+class TOONSHADE_OT_BakeColorRampLUT(Operator):
+    """Bake the time of day color ramp into a lookup table image, so renders sample a texture instead of evaluating the ramp"""
+    bl_idname = "toonshade.bake_color_ramp_lut"
+    bl_label = "Bake Color Ramp LUT"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    remove: BoolProperty(
+        name="Remove",
+        description="Connect the color ramp back instead of baking it",
+        default=False
+    )
+
+    def execute(self, context):
+        node_tree = bpy.data.node_groups.get(ENVIRONMENT_NODETREE_NAME)
+        if not node_tree or node_tree.library:
+            self.report({'ERROR'}, f"No local {ENVIRONMENT_NODETREE_NAME} node tree")
+            return {'CANCELLED'}
+        if self.remove:
+            remove_color_ramp_lut(node_tree)
+            return {'FINISHED'}
+        if not use_color_ramp_lut(node_tree):
+            self.report({'ERROR'}, f"{ENVIRONMENT_NODETREE_NAME} has no color ramp to bake")
+            return {'CANCELLED'}
+        return {'FINISHED'}
+
+class TOONSHADE_OT_ReportProfile(Operator):
+    """Print the Toon Shade counters and timings to the console"""
+    bl_idname = "toonshade.report_profile"
+    bl_label = "Report Toon Shade Profile"
+
+    reset: BoolProperty(
+        name="Reset",
+        description="Reset the counters and timings after reporting them",
+        default=False
+    )
+
+    def execute(self, context):
+        lines = profiler.get_report_lines()
+        if not lines:
+            self.report({'INFO'}, "Nothing profiled yet")
+            return {'FINISHED'}
+        print("Toon Shade profile:")
+        for line in lines:
+            print(f"  {line}")
+        self.report({'INFO'}, f"Toon Shade profile: {len(lines)} entries printed to the console")
+        if self.reset:
+            profiler.reset()
+        return {'FINISHED'}
+
 classes = (
     TOONSHADE_OT_ImportNodeTrees,
     TOONSHADE_OT_ToggleLinkOverride,
     TOONSHADE_OT_AddNodeTree,
+    TOONSHADE_OT_SelectUsers,
+    TOONSHADE_OT_MergeDuplicateNodeGroups,
+    TOONSHADE_OT_SplitLibrary,
+    TOONSHADE_OT_BakeColorRampLUT,
+    TOONSHADE_OT_ReportProfile,
 )
 
 register, unregister = register_classes_factory(classes)
\ No newline at end of file
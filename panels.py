@@ -3,6 +3,10 @@ from bpy.utils import register_classes_factory
 from .properties import ToonShade, TS_NODETREE_NAMES
 from . import addon_updater_ops
 from .common import find_node
+from .usage import usage_index
+from .cache import toonshade_node_cache
+from .library import load_library_manifest
+from .environment import get_lut_node
 
 @addon_updater_ops.make_annotations
 class ToonShadePreferences(bpy.types.AddonPreferences):
@@ -43,9 +47,27 @@ class ToonShadePreferences(bpy.types.AddonPreferences):
 		min=0,
 		max=59)
 
+	# Library preferences.
+
+	use_library_prewarm = bpy.props.BoolProperty(
+		name="Prewarm Library",
+		description="Read the node group library in the background after startup and file loads, so the first insert is as fast as later ones",
+		default=True)
+
+	library_cache_directory = bpy.props.StringProperty(
+		name="Library Cache",
+		description="Local directory to copy the node group library to, for addons installed on a slow network share. Linked node groups still point to the installed library",
+		subtype='DIR_PATH',
+		default="")
+
 	def draw(self, context):
 		layout = self.layout
 
+		row = layout.row()
+		row.prop(self, "use_library_prewarm")
+		row.operator("toonshade.split_library")
+		layout.prop(self, "library_cache_directory")
+
 		# Works best if a column, or even just self.layout.
 		mainrow = layout.row()
 		col = mainrow.column()
@@ -66,6 +88,55 @@ class ToonShadePreferences(bpy.types.AddonPreferences):
 		# ops.url=addon_updater_ops.updater.website
 
 
+class ToonShadeDrawModel():
+    """Everything ToonShadePanel draws, resolved once per change instead of on every redraw"""
+    models = {}
+    revision = None
+    # Usage counts are the same for every model, so they are counted once per usage index revision
+    usage_counts = None
+    usage_revision = None
+
+    def __init__(self, context):
+        ts = ToonShade(context)
+        self.settings = ts.settings
+        self.toonshade_nodes = ts.get_toonshade_nodes()
+        self.env_color_nodetree = bpy.data.node_groups.get("Environment Color")
+        self.colorramp_node = find_node(self.env_color_nodetree, {"name": "Toon Shade Color Ramp"})
+        self.lut_node = get_lut_node(self.env_color_nodetree) if self.env_color_nodetree else None
+
+    @property
+    def usage(self):
+        cls = type(self)
+        # The index is built on a timer after loads, drawing never waits for it
+        if usage_index.is_dirty:
+            return None
+        if cls.usage_revision != usage_index.revision:
+            cls.usage_counts = [
+                (tree_name, len(usage_index.materials_using(tree_name)), len(usage_index.objects_using(tree_name)))
+                for tree_name in TS_NODETREE_NAMES
+                ]
+            cls.usage_revision = usage_index.revision
+        return cls.usage_counts
+
+    @classmethod
+    def get(cls, context) -> "ToonShadeDrawModel":
+        revision = toonshade_node_cache.revision
+        if revision != cls.revision:
+            cls.models.clear()
+            cls.revision = revision
+        material = context.object.active_material if context.object else None
+        node_tree = material.node_tree if material else None
+        key = (
+            context.view_layer.as_pointer(),
+            material.as_pointer() if material else 0,
+            node_tree.as_pointer() if node_tree else 0,
+            )
+        model = cls.models.get(key)
+        if model is None:
+            model = cls.models[key] = cls(context)
+        return model
+
+
 class ToonShadePanel(bpy.types.Panel):
     """Creates a Panel in the Object properties window"""
     bl_label = "Toon Shade"
@@ -77,7 +148,7 @@ class ToonShadePanel(bpy.types.Panel):
     def draw(self, context):
         layout = self.layout
 
-        ts = ToonShade(context)
+        model = ToonShadeDrawModel.get(context)
         
         col = layout.column()
         col.scale_y = 1.5
@@ -91,7 +162,7 @@ class ToonShadePanel(bpy.types.Panel):
             # ops.use_transform=True
             # ops.settings=[{"name": "node_tree", "value": f"bpy.data.node_groups['{tree_name}']"}]
             # ops.type = "ShaderNodeGroup"
-        ts_nodes = ts.get_toonshade_nodes()
+        ts_nodes = model.toonshade_nodes
         if not ts_nodes:
             layout.label(text="Toon Shade is not connected")
             return
@@ -100,15 +171,17 @@ class ToonShadePanel(bpy.types.Panel):
         box = layout.box()
         col = box.column()
         col.scale_y = 1.5
-        col.prop(ts.settings, "time_of_day")
+        col.prop(model.settings, "time_of_day")
         
-        env_color_nodetree = bpy.data.node_groups.get("Environment Color")
-        if not env_color_nodetree:
+        if not model.env_color_nodetree:
             return
-        colorramp_node = find_node(env_color_nodetree, {"name": "Toon Shade Color Ramp"})
-        if colorramp_node:
+        if model.colorramp_node:
             box.label(text="Time of Day Colors:")
-            box.template_node_inputs(colorramp_node)
+            box.template_node_inputs(model.colorramp_node)
+            if model.lut_node:
+                box.operator("toonshade.bake_color_ramp_lut", text="Remove Color Ramp LUT", icon='X').remove = True
+            else:
+                box.operator("toonshade.bake_color_ramp_lut", icon='IMAGE_DATA')
         
         layout.label(text="Shader Settings:")
         for ts_node in ts_nodes:
@@ -118,6 +191,17 @@ class ToonShadePanel(bpy.types.Panel):
             box = layout.box()
             box.template_node_inputs(ts_node)
 
+        layout.label(text="Usage:")
+        box = layout.box()
+        if model.usage is None:
+            box.label(text="Indexing...")
+            return
+        col = box.column()
+        for tree_name, material_count, object_count in model.usage:
+            row = col.row()
+            row.label(text=f"{tree_name}: {material_count} materials, {object_count} objects")
+            row.operator("toonshade.select_users", text="", icon='RESTRICT_SELECT_OFF').node_tree_name = tree_name
+
 
 class MAT_MT_ToonShadeAddNode(bpy.types.Menu):
     bl_label = "Add Toon Shade Node Menu"
@@ -128,7 +212,11 @@ class MAT_MT_ToonShadeAddNode(bpy.types.Menu):
         row = layout.row()
         col = row.column()
         col.label(text="Toon Shade Nodes:")
+        # Without an up to date manifest, offer everything and let the operator report what is missing
+        manifest = load_library_manifest()
         for idx, tree_name in enumerate(TS_NODETREE_NAMES):
+            if manifest and tree_name not in manifest["node_groups"]:
+                continue
             col.operator("toonshade.add_node_tree", text=f"Add {tree_name}", icon='NODE_MATERIAL' if idx == 0 else 'NONE').node_tree_name = tree_name
 
 
@@ -0,0 +1,49 @@
+import time
+from contextlib import contextmanager
+
+class ToonShadeProfiler():
+    """Counters and timings of the addon's expensive operations.
+
+    Cheap enough to stay enabled: a counter is a dict update and a timing
+    two perf_counter calls.
+    """
+    def __init__(self):
+        self.counters = {}
+        # Timing name -> [calls, total seconds, last seconds, max seconds]
+        self.timings = {}
+
+    def count(self, name: str, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_timing(self, name: str, seconds: float):
+        timing = self.timings.get(name)
+        if timing is None:
+            self.timings[name] = [1, seconds, seconds, seconds]
+            return
+        timing[0] += 1
+        timing[1] += seconds
+        timing[2] = seconds
+        timing[3] = max(timing[3], seconds)
+
+    @contextmanager
+    def timed(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(name, time.perf_counter() - start)
+
+    def get_report_lines(self):
+        lines = [f"{name}: {value}" for name, value in sorted(self.counters.items())]
+        for name, (calls, total, last, longest) in sorted(self.timings.items()):
+            lines.append(
+                f"{name}: {calls} calls, avg {total / calls * 1000:.3f} ms, "
+                f"last {last * 1000:.3f} ms, max {longest * 1000:.3f} ms"
+                )
+        return lines
+
+    def reset(self):
+        self.counters.clear()
+        self.timings.clear()
+
+profiler = ToonShadeProfiler()
@@ -1,31 +1,121 @@
 import bpy
-from bpy.types import NodeTree, PropertyGroup, Context
+import os
+import tempfile
+from bpy.types import Material, NodeTree, PropertyGroup, Context
 from bpy.props import FloatProperty, PointerProperty
-from .common import get_addon_filepath, get_connected_nodes, get_active_material_output
+from typing import Dict, List
+from .common import get_connected_nodes, get_active_material_output, get_node_tree_hash, patch_node_tree, search_nodes
+from .cache import toonshade_node_cache
+from .profiling import profiler
+from .environment import ENVIRONMENT_NODETREE_NAME, ensure_view_layer_time_of_day, get_lut_node, use_color_ramp_lut
+from .library import LIBRARY_HASH_PROPERTY, get_library_filepath, get_library_manifest, get_library_sources, load_library_file
 
-LIBRARY_FILE_NAME = "library.blend"
 TS_NODETREE_NAMES = [
     "Toon Shade Goo",
     "Environment Color",
     "Color Blender",
     ]
 
-def cleanup_duplicate_nodegroups(node_tree: NodeTree):
+def is_toonshade_node(node) -> bool:
+    """Check whether a node is an instance of one of the Toon Shade node groups"""
+    node_tree = getattr(node, "node_tree", None)
+    return node_tree is not None and node_tree.name in TS_NODETREE_NAMES
+
+def build_nodegroup_base_name_index() -> Dict[str, List[NodeTree]]:
+    """Index all node groups by base name, the part of their name before the first dot"""
+    base_name_index = {}
+    for ng in bpy.data.node_groups:
+        base_name_index.setdefault(ng.name.split('.')[0], []).append(ng)
+    return base_name_index
+
+def count_nodegroup_versions_added(existing_pointers, existing_base_names) -> int:
+    """Count the node groups added since a snapshot whose base name was already in the file
+
+    New nested node groups a load brings in are expected, another version of
+    a node group the file already had is not.
+
+    Args:
+        existing_pointers (set): Pointers of the node groups at the snapshot
+        existing_base_names (set): Base names of the node groups at the snapshot
     """
-    Cleanup duplicate node groups by using Blender's remap_users feature.
-    This automatically handles all node links and nested node groups.
+    return sum(
+        1 for ng in bpy.data.node_groups
+        if ng.as_pointer() not in existing_pointers and ng.name.split('.')[0] in existing_base_names
+        )
+
+def remove_nodegroups(node_groups, base_name_index: Dict[str, List[NodeTree]] = None):
+    """Remove node groups in one batch, keeping a base name index in sync"""
+    node_groups = list(node_groups)
+    if not node_groups:
+        return
+    if base_name_index is not None:
+        removed = set(node_groups)
+        for base_name in {ng.name.split('.')[0] for ng in node_groups}:
+            base_name_index[base_name] = [ng for ng in base_name_index.get(base_name, []) if ng not in removed]
+    bpy.data.batch_remove(node_groups)
+
+def get_suffix_number(ng: NodeTree) -> int:
+    """Get the number of the .001, .002 etc. suffix of a node group name, 0 without one"""
+    parts = ng.name.split(".")
+    if len(parts) > 1:
+        try:
+            return int(parts[-1])
+        except ValueError:
+            return 0
+    return 0
+
+def remap_nodegroups(remaps: Dict[NodeTree, NodeTree], base_name_index: Dict[str, List[NodeTree]] = None):
+    """Remap the users of node groups to other ones, then remove them in one batch
+
+    Chains such as a -> b -> c are collapsed first, so every user is remapped only once.
 
     Args:
-        node_group_name (str): Name of the main node group to clean up
+        remaps (Dict[NodeTree, NodeTree]): The node groups to replace and their replacements
+        base_name_index (optional): Node groups by base name, kept up to date
     """
+    def resolve(ng):
+        seen = set()
+        while ng in remaps and ng not in seen:
+            seen.add(ng)
+            ng = remaps[ng]
+        return ng
+
+    removed = []
+    for ng in remaps:
+        target = resolve(ng)
+        if target in remaps:
+            # Part of a cycle, nothing to remap it to
+            continue
+        print(f"Remapping users from {ng.name} to {target.name}")
+        ng.user_remap(target)
+        removed.append(ng)
+    remove_nodegroups(removed, base_name_index)
+
+def find_duplicate_nodegroups(node_tree: NodeTree,
+                              base_name_index: Dict[str, List[NodeTree]],
+                              remaps: Dict[NodeTree, NodeTree] = None) -> Dict[NodeTree, NodeTree]:
+    """
+    Find the suffixed duplicates of the node groups used by a node tree, and the originals to replace them with.
+
+    Args:
+        node_tree (NodeTree): The main node group to check
+        base_name_index: Node groups by base name, see build_nodegroup_base_name_index
+        remaps (optional): Remaps already planned. Originals are resolved through them,
+            and node groups they already replace are left alone
+
+    Returns:
+        Dict[NodeTree, NodeTree]: The duplicates and their originals
+    """
+    if remaps is None:
+        remaps = {}
+
     def find_original_nodegroup(name):
         # Get the base name by removing the .001, .002 etc. if present
         # This gets the part before the first dot
         base_name = name.split('.')[0]
 
         # Find all matching node groups
-        matching_groups = [ng for ng in bpy.data.node_groups
-                           if ng.name == base_name or ng.name.split('.')[0] == base_name]
+        matching_groups = base_name_index.get(base_name)
 
         if not matching_groups:
             return None
@@ -37,7 +127,7 @@ def cleanup_duplicate_nodegroups(node_tree: NodeTree):
                 return ng
 
         # If we didn't find an exact match, return the one with lowest suffix number
-        return sorted(matching_groups, key=lambda x: x.name)[0]
+        return min(matching_groups, key=lambda x: x.name)
 
     # Get active Group output node
     def get_active_group_output_node(node_tree):
@@ -46,26 +136,118 @@ def cleanup_duplicate_nodegroups(node_tree: NodeTree):
                 return node
         return None
     
+    duplicates = {}
     active_output_node = get_active_group_output_node(node_tree)
     if not active_output_node:
-        return
+        return duplicates
 
-    # Process each node group
-    for node in get_connected_nodes(active_output_node):
+    for node in get_connected_nodes(active_output_node).nodes():
         # print(f"Checking node: {node.name}")
         if node.type == 'GROUP' and node.node_tree:
             ng = node.node_tree
+            if ng in duplicates or ng in remaps:
+                continue
 
             # Find the original node group
             original_group = find_original_nodegroup(ng.name)
+            while original_group in remaps:
+                original_group = remaps[original_group]
 
             # If this is a duplicate (not the original) and we found the original
-            if original_group and ng != original_group and ng.name.startswith(original_group.name):
-                print(f"Cleaning up duplicate node group: {ng.name}")
-                # Remap all users of this node group to the original
-                ng.user_remap(original_group)
-                # Remove the now-unused node group
-                bpy.data.node_groups.remove(ng)
+            if original_group and ng != original_group and ng.name.startswith(original_group.name.split('.')[0]):
+                duplicates[ng] = original_group
+    return duplicates
+
+def cleanup_duplicate_nodegroups(node_tree: NodeTree, base_name_index: Dict[str, List[NodeTree]] = None):
+    """
+    Cleanup duplicate node groups by using Blender's remap_users feature.
+    This automatically handles all node links and nested node groups.
+
+    Args:
+        node_tree (NodeTree): The main node group to clean up
+        base_name_index (optional): Node groups by base name, see build_nodegroup_base_name_index.
+            Pass the same index to several cleanups to build it only once, it is kept up to date
+    """
+    if base_name_index is None:
+        base_name_index = build_nodegroup_base_name_index()
+    remap_nodegroups(find_duplicate_nodegroups(node_tree, base_name_index), base_name_index)
+
+def find_structural_duplicates(hashes: Dict[NodeTree, str] = None) -> Dict[NodeTree, List[NodeTree]]:
+    """Find node groups with the same structure, whatever their names
+
+    Node groups are compared by common.get_node_tree_hash, so two groups
+    whose nested groups are themselves duplicates also match.
+
+    Args:
+        hashes (optional): Already computed hashes, filled as node groups get hashed
+
+    Returns:
+        Dict[NodeTree, List[NodeTree]]: The node group to keep for every set of duplicates, and the local duplicates to merge into it
+    """
+    if hashes is None:
+        hashes = {}
+    groups_by_hash = {}
+    for ng in bpy.data.node_groups:
+        groups_by_hash.setdefault(get_node_tree_hash(ng, hashes), []).append(ng)
+
+    def get_keep_priority(ng):
+        # Keep linked groups, then the one without a suffix or with the lowest one
+        return (ng.library is None, ng.name != ng.name.split('.')[0], ng.name)
+
+    duplicates = {}
+    for groups in groups_by_hash.values():
+        if len(groups) < 2:
+            continue
+        groups.sort(key=get_keep_priority)
+        local_duplicates = [ng for ng in groups[1:] if ng.library is None]
+        if local_duplicates:
+            duplicates[groups[0]] = local_duplicates
+    return duplicates
+
+def get_partial_write_size(id_datas) -> int:
+    """Get the size of an uncompressed .blend file holding the given datablocks and the data they reference"""
+    with tempfile.TemporaryDirectory() as directory:
+        filepath = os.path.join(directory, "size.blend")
+        bpy.data.libraries.write(filepath, set(id_datas), compress=False)
+        return os.path.getsize(filepath)
+
+def get_removal_size(kept, removed) -> int:
+    """Get the number of .blend bytes removing datablocks saves, while others are kept
+
+    Written files also hold the data their datablocks reference, so the size
+    is the difference between writing both and writing the kept ones only.
+    Data the removed datablocks share with the kept ones is then not counted.
+    """
+    return get_partial_write_size(kept + removed) - get_partial_write_size(kept)
+
+def merge_duplicate_nodegroups(dry_run=False) -> dict:
+    """Merge node groups with the same structure into one, see find_structural_duplicates
+
+    Args:
+        dry_run (bool): Only report what would be merged
+
+    Returns:
+        dict: Report with the merged names ("merged": {kept name: [duplicate names]})
+        and the number of node groups, nodes, links and .blend bytes saved
+    """
+    duplicates = find_structural_duplicates()
+    all_duplicates = [ng for groups in duplicates.values() for ng in groups]
+    report = {
+        "merged": {kept.name: [ng.name for ng in groups] for kept, groups in duplicates.items()},
+        "node_groups": len(all_duplicates),
+        "nodes": sum(len(ng.nodes) for ng in all_duplicates),
+        "links": sum(len(ng.links) for ng in all_duplicates),
+        "bytes": get_removal_size(list(duplicates), all_duplicates) if all_duplicates else 0,
+    }
+    if dry_run or not all_duplicates:
+        return report
+
+    for kept, groups in duplicates.items():
+        for ng in groups:
+            print(f"Merging duplicate node group {ng.name} into {kept.name}")
+            ng.user_remap(kept)
+    remove_nodegroups(all_duplicates)
+    return report
 
 class ToonShade():
     def __init__(self, context: Context):
@@ -85,75 +267,301 @@ class ToonShade():
         return True
     
     def import_ts_node_trees(self):
-        for tree_name in TS_NODETREE_NAMES:
-            self.get_nodetree_from_library(tree_name, force_reload=True, link=True)
+        self.get_nodetrees_from_library(TS_NODETREE_NAMES, force_reload=True, link=True)
     
-    def get_nodetree_from_library(self, tree_name, force_reload=False, link=False) -> NodeTree:
-        print(f"Loading node group: {tree_name}")
-        # Check if the node group already exists
-        nt = bpy.data.node_groups.get(tree_name)
-        old_nt = None
-        if nt:
-            if not force_reload:
-                return nt
-            old_nt = nt.copy()
-
-        # Load the library file
-        filepath = get_addon_filepath() + LIBRARY_FILE_NAME
-        with bpy.data.libraries.load(filepath, link=link) as (lib_file, current_file):
-            lib_node_group_names = lib_file.node_groups
-            current_node_groups_names = current_file.node_groups
-            for node_group_name in lib_node_group_names:
-                if node_group_name == tree_name:
-                    current_node_groups_names.append(node_group_name)
-        
-        # Getting the node group
+    def get_nodetree_from_library(self, tree_name, force_reload=False, link=False, in_place=False) -> NodeTree:
+        return self.get_nodetrees_from_library([tree_name], force_reload=force_reload, link=link, in_place=in_place).get(tree_name)
+
+    def get_nodetrees_from_library(self, tree_names, force_reload=False, link=False, in_place=False) -> Dict[str, NodeTree]:
+        """Get several node groups, loading the missing ones from the library
+
+        The library file is opened once for all of them, and the suffixed
+        versions left behind by the load are reconciled in a single pass.
+
+        Args:
+            tree_names (Iterable[str]): Names of the node groups
+            force_reload (bool): Reload node groups that already exist in the file
+            link (bool): Link the node groups instead of appending them
+            in_place (bool): Reload appended node groups by patching them in place
+                instead of replacing them (see patch_nodetrees_from_library)
+
+        Returns:
+            Dict[str, bpy.types.NodeTree]: The node groups that could be found, by name
+        """
+        node_trees = {}
+        tree_names_to_load = []
+        tree_names_to_patch = []
+        # The color ramp lookup table is wired in by the addon, not the library, so reloads have to put it back
+        env_color_nodetree = bpy.data.node_groups.get(ENVIRONMENT_NODETREE_NAME)
+        use_lut = bool(env_color_nodetree and get_lut_node(env_color_nodetree))
+        for tree_name in tree_names:
+            # Check if the node group already exists
+            nt = bpy.data.node_groups.get(tree_name)
+            if nt:
+                if not force_reload:
+                    node_trees[tree_name] = nt
+                    continue
+                if in_place and not link and not nt.library:
+                    tree_names_to_patch.append(tree_name)
+                    continue
+            tree_names_to_load.append(tree_name)
+        if tree_names_to_patch:
+            patched_pointers = {ng.as_pointer() for ng in bpy.data.node_groups}
+            patched_base_names = {ng.name.split('.')[0] for ng in bpy.data.node_groups}
+            patched_node_trees = self.patch_nodetrees_from_library(tree_names_to_patch)
+            node_trees.update(patched_node_trees)
+            if patched_node_trees:
+                # Same counters as replacing reloads, patching in place must not add versions either
+                profiler.count("library.reloads")
+                profiler.count("library.reload_node_groups_added",
+                               count_nodegroup_versions_added(patched_pointers, patched_base_names))
+            self.restore_color_ramp_lut(use_lut)
+            # Node groups that cannot be patched are replaced as usual
+            tree_names_to_load += [tree_name for tree_name in tree_names_to_patch if tree_name not in patched_node_trees]
+        if not tree_names_to_load:
+            return node_trees
+        print(f"Loading node groups: {', '.join(tree_names_to_load)}")
+
+        # The manifest tells which node groups the library has without opening it
+        lib_node_group_names = get_library_manifest()["node_groups"]
+        tree_names_to_load = [tree_name for tree_name in tree_names_to_load if tree_name in lib_node_group_names]
+        if not tree_names_to_load:
+            return node_trees
+
+        # Snapshot which node groups exist, to roll back a failed load and to check that reloads do not leak groups
+        existing_pointers = {ng.as_pointer() for ng in bpy.data.node_groups}
+        existing_base_names = {ng.name.split('.')[0] for ng in bpy.data.node_groups}
+        existing_library_pointers = {library.as_pointer() for library in bpy.data.libraries}
+        is_reload = all(tree_name in bpy.data.node_groups for tree_name in tree_names_to_load)
+
+        # Load the library files, only the ones holding the requested node groups if the library is split
+        try:
+            with profiler.timed("library.load"):
+                if link:
+                    # Split files are an optional build output, so links always point to the library itself
+                    with load_library_file(get_library_filepath(), link=True) as (lib_file, current_file):
+                        current_file.node_groups = tree_names_to_load
+                    loaded_names = tree_names_to_load
+                else:
+                    loaded_names = self.append_nodetrees_minimal(tree_names_to_load, lib_node_group_names)
+        except Exception:
+            bpy.data.batch_remove([ng for ng in bpy.data.node_groups if ng.as_pointer() not in existing_pointers])
+            bpy.data.batch_remove([library for library in bpy.data.libraries
+                                   if library.as_pointer() not in existing_library_pointers])
+            raise
+
+        # Registry of the versions of every node group by base name, shared by the whole reconciliation
+        base_name_index = build_nodegroup_base_name_index()
+        for tree_name, nt in self.reconcile_nodetree_versions(loaded_names, base_name_index, link=link).items():
+            if not nt.library:
+                nt[LIBRARY_HASH_PROPERTY] = lib_node_group_names[tree_name]["hash"]
+            if tree_name in tree_names_to_load:
+                node_trees[tree_name] = nt
+        self.restore_color_ramp_lut(use_lut)
+
+        if is_reload:
+            # Should stay at 0: a reload replaces node groups, new nested ones aside it never adds another version
+            profiler.count("library.reloads")
+            profiler.count("library.reload_node_groups_added",
+                           count_nodegroup_versions_added(existing_pointers, existing_base_names))
+        return node_trees
+
+    def restore_color_ramp_lut(self, use_lut):
+        """Rewire the color ramp lookup table into Environment Color if a reload dropped it
+
+        Args:
+            use_lut (bool): Whether Environment Color used the lookup table before the reload
+        """
+        env_color_nodetree = bpy.data.node_groups.get(ENVIRONMENT_NODETREE_NAME)
+        if use_lut and env_color_nodetree and not env_color_nodetree.library and not get_lut_node(env_color_nodetree):
+            use_color_ramp_lut(env_color_nodetree)
+
+    def append_nodetrees_minimal(self, tree_names, lib_node_groups) -> List[str]:
+        """Append node groups without duplicating the nested node groups the file already has
+
+        The nested dependencies are resolved from the manifest first. The
+        requested node groups are linked, made local, and every nested node
+        group that is already in the file at the same content hash is remapped
+        to the local one instead of being made local too. Only missing or stale
+        node groups end up appended, so no throwaway ".001" copies are created.
+
+        Args:
+            tree_names (Iterable[str]): Names of the node groups
+            lib_node_groups (dict): The node groups of the library manifest
+
+        Returns:
+            List[str]: Names of the node groups that got a new local version, nested ones included
+        """
+        hashes = {}
+
+        def is_current(name):
+            ng = bpy.data.node_groups.get(name)
+            if not ng or ng.library:
+                return False
+            # Node groups appended before hashes were stamped get hashed once
+            content_hash = ng.get(LIBRARY_HASH_PROPERTY) or get_node_tree_hash(ng, hashes)
+            return content_hash == lib_node_groups[name]["hash"]
+
+        dependency_names = set()
+        stack = list(tree_names)
+        while stack:
+            for dependency in lib_node_groups.get(stack.pop(), {}).get("dependencies", []):
+                if dependency not in dependency_names and dependency in lib_node_groups:
+                    dependency_names.add(dependency)
+                    stack.append(dependency)
+        current_names = {name for name in dependency_names - set(tree_names) if is_current(name)}
+        profiler.count("library.nested_duplicates_avoided", len(current_names))
+
+        linked_groups = []
+        for filepath, names in get_library_sources(tree_names).items():
+            with load_library_file(filepath, link=True) as (lib_file, current_file):
+                current_file.node_groups = names
+            linked_groups += [ng for ng in current_file.node_groups if ng]
+
+        local_groups = {}
+        appended_names = []
+
+        def localize(linked_ng):
+            # Parents first, so that their nested groups are only used by local data when made local
+            if linked_ng in local_groups:
+                return
+            name = linked_ng.name
+            if name in current_names:
+                local_ng = bpy.data.node_groups.get(name)
+                linked_ng.user_remap(local_ng)
+                local_groups[linked_ng] = local_ng
+                return
+            local_ng = linked_ng.make_local()
+            local_groups[linked_ng] = local_ng
+            appended_names.append(name)
+            for node in local_ng.nodes:
+                sub_tree = getattr(node, "node_tree", None)
+                if sub_tree and sub_tree.library:
+                    localize(sub_tree)
+
+        libraries = {ng.library for ng in linked_groups}
+        for linked_ng in linked_groups:
+            localize(linked_ng)
+
+        # Drop what is left of the linked data, the whole library if nothing else uses it
+        for library in libraries:
+            leftovers = [id_data for id_data in library.users_id if id_data.users == 0]
+            if len(leftovers) == len(library.users_id):
+                bpy.data.libraries.remove(library)
+            elif leftovers:
+                bpy.data.batch_remove(leftovers)
+        return appended_names
+
+    def patch_nodetrees_from_library(self, tree_names) -> Dict[str, NodeTree]:
+        """Update node groups in place to match the library
+
+        The library groups are loaded into temporary data and only the nodes,
+        links and values that differ are written (see common.patch_node_tree),
+        nested node groups first. The node groups keep their identity, so their
+        users are never remapped and unchanged materials are not recompiled.
+
+        Args:
+            tree_names (Iterable[str]): Names of the node groups
+
+        Returns:
+            Dict[str, bpy.types.NodeTree]: The node groups that could be patched, by name
+        """
+        lib_node_groups = get_library_manifest()["node_groups"]
+        tree_names = [tree_name for tree_name in tree_names if tree_name in lib_node_groups]
+        if not tree_names:
+            return {}
+        print(f"Patching node groups: {', '.join(tree_names)}")
+
+        patched_node_trees = {}
+        with bpy.data.temp_data() as temp_data:
+            for filepath, names in get_library_sources(tree_names).items():
+                with load_library_file(filepath, data=temp_data) as (lib_file, temp_file):
+                    temp_file.node_groups = names
+
+            node_tree_map = {}
+            failed_names = set()
+
+            def patch(source_tree):
+                if source_tree in node_tree_map or source_tree.name in failed_names:
+                    return
+                for node in source_tree.nodes:
+                    if getattr(node, "node_tree", None):
+                        patch(node.node_tree)
+                nt = bpy.data.node_groups.get(source_tree.name)
+                if not nt or nt.library or not patch_node_tree(nt, source_tree, node_tree_map):
+                    failed_names.add(source_tree.name)
+                    return
+                node_tree_map[source_tree] = nt
+                lib_node_group = lib_node_groups.get(source_tree.name)
+                if lib_node_group and nt.get(LIBRARY_HASH_PROPERTY) != lib_node_group["hash"]:
+                    nt[LIBRARY_HASH_PROPERTY] = lib_node_group["hash"]
+
+            for tree_name in tree_names:
+                source_tree = temp_data.node_groups.get(tree_name)
+                if not source_tree:
+                    continue
+                patch(source_tree)
+                if source_tree in node_tree_map:
+                    patched_node_trees[tree_name] = node_tree_map[source_tree]
+        return patched_node_trees
+
+    def is_nodetree_up_to_date(self, tree_name, link=False) -> bool:
+        """Check whether the node group in the file is the same version as the one in the library
+
+        Compares the hash stamped on the node group when it was appended with
+        the library manifest, so neither node tree has to be inspected.
+        """
         nt = bpy.data.node_groups.get(tree_name)
-        if not nt:
-            return None
-        
-        # Find all node groups with the same base name
-        matching_groups = [ng for ng in bpy.data.node_groups 
-                  if ng.name == tree_name or ng.name.startswith(tree_name + ".")]
-        
-        if len(matching_groups) > 1:
-            # Sort by suffix number - those without a suffix are considered version 0
-            def get_suffix_number(ng):
-                if ng.name == tree_name:
-                    return 0
-                parts = ng.name.split(".")
-                if len(parts) > 1:
-                    try:
-                        return int(parts[-1])
-                    except ValueError:
-                        return 0
-                return 0
-            
-            sorted_groups = sorted(matching_groups, key=get_suffix_number)
-            
-            # Get the latest version (highest suffix)
-            latest_version = sorted_groups[-1]
-            
-            # Remap all older versions to the latest one
-            for old_ng in sorted_groups[:-1]:
-                cleanup_duplicate_nodegroups(old_ng)
-                print(f"Remapping users from {old_ng.name} to {latest_version.name}")
-                old_ng.user_remap(latest_version)
-                bpy.data.node_groups.remove(old_ng)
-            
-            # Use the latest version
-            nt = latest_version
-        
-        # Ensure the node group has the correct name (without suffix)
-        if nt.name != tree_name:
-            nt.name = tree_name
-        
+        if not nt or bool(nt.library) != link:
+            return False
+        if nt.library:
+            # Linked data is read from the library every time the file is opened
+            return True
+        lib_node_group = get_library_manifest()["node_groups"].get(tree_name)
+        return lib_node_group is not None and nt.get(LIBRARY_HASH_PROPERTY) == lib_node_group["hash"]
+
+    def reconcile_nodetree_versions(self, tree_names, base_name_index, link=False) -> Dict[str, NodeTree]:
+        """Keep the latest loaded version of node groups and remap the users of the others to it
+
+        The versions come from the base name registry, so only the node groups
+        involved are touched. Stale versions and the duplicates of nested node
+        groups are remapped in a single batch, so every user is remapped once.
+
+        Args:
+            tree_names (Iterable[str]): Names of the loaded node groups
+            base_name_index: Node groups by base name, see build_nodegroup_base_name_index
+            link (bool): Whether the node groups were linked
+
+        Returns:
+            Dict[str, bpy.types.NodeTree]: The kept node groups, by name
+        """
+        latest_versions = {}
+        remaps = {}
+        for tree_name in tree_names:
+            # Find all node groups with the same base name
+            versions = [ng for ng in base_name_index.get(tree_name.split('.')[0], [])
+                        if ng.name == tree_name or ng.name.startswith(tree_name + ".")]
+            if not versions:
+                continue
+            # Sort by suffix number and keep the latest version (highest suffix)
+            latest_version = sorted(versions, key=get_suffix_number)[-1]
+            latest_versions[tree_name] = latest_version
+            for ng in versions:
+                if ng != latest_version:
+                    remaps[ng] = latest_version
+
         if not link:
-            # Rename the new node group
-            nt.name = tree_name
-            nt.use_fake_user = True
-            cleanup_duplicate_nodegroups(nt)
-        return nt
+            for nt in latest_versions.values():
+                remaps.update(find_duplicate_nodegroups(nt, base_name_index, remaps))
+        remap_nodegroups(remaps, base_name_index)
+        
+        for tree_name, nt in latest_versions.items():
+            # Ensure the node group has the correct name (without suffix)
+            if nt.name != tree_name:
+                nt.name = tree_name
+            if not link:
+                nt.use_fake_user = True
+        return latest_versions
     
     def get_toonshade_nodes(self):
         obj = self.context.object
@@ -162,16 +570,33 @@ class ToonShade():
         mat = obj.active_material
         if not mat:
             return None
+        return toonshade_node_cache.get(mat, self.find_toonshade_nodes)
+
+    @staticmethod
+    def find_toonshade_nodes(mat: Material):
+        """Find the Toon Shade nodes connected to the material output
+
+        Returns:
+            The Toon Shade nodes (or None if the material has no active output)
+            and the node trees walked to find them
+        """
+        if not mat.node_tree:
+            return None, []
         output_node = get_active_material_output(mat.node_tree)
         if not output_node:
-            return None
-        nodes = get_connected_nodes(output_node)
+            return None, []
+        # Only the group instances are wanted, so never descend into a Toon Shade group
+        node_trees = set()
         toonshade_nodes = []
-        for node in nodes:
-            if hasattr(node, "node_tree") and node.node_tree.name in TS_NODETREE_NAMES:
+        for _, node in search_nodes(output_node, is_toonshade_node, skip=is_toonshade_node, node_trees=node_trees):
+            if node not in toonshade_nodes:
                 toonshade_nodes.append(node)
-        return toonshade_nodes
+        return toonshade_nodes, node_trees
+
 
+def update_time_of_day(self, context):
+    # Shaders read the property of each view layer directly, older node trees only need switching over once
+    ensure_view_layer_time_of_day()
 
 class ToonShadeProperties(PropertyGroup):
     time_of_day: FloatProperty(
@@ -179,6 +604,7 @@ class ToonShadeProperties(PropertyGroup):
         description="Time of Day",
         default=0.0,
         unit='TIME',
+        update=update_time_of_day,
     )
 
 
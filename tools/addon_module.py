@@ -0,0 +1,18 @@
+"""Import the addon from the scripts in tools, which Blender runs outside of the addon package"""
+import importlib
+import importlib.util
+import os
+import sys
+
+ADDON_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Imported under a fixed name, the addon directory name may not be a valid identifier
+PACKAGE_NAME = "toonshade"
+
+def import_addon_module(module_name):
+    if PACKAGE_NAME not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            PACKAGE_NAME, os.path.join(ADDON_DIRECTORY, "__init__.py"), submodule_search_locations=[ADDON_DIRECTORY])
+        package = importlib.util.module_from_spec(spec)
+        sys.modules[PACKAGE_NAME] = package
+        spec.loader.exec_module(package)
+    return importlib.import_module(f"{PACKAGE_NAME}.{module_name}")
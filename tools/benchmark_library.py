@@ -0,0 +1,197 @@
+"""Benchmark loading the Toon Shade node groups from differently stored libraries
+
+Writes the node groups of the library in several storage variants, then
+times appending and linking each Toon Shade node tree from every variant,
+with the file in the OS page cache (warm) and, where the OS allows dropping
+it, out of it (cold). Release packaging can pick the fastest variant from
+the results.
+
+Run it from a factory startup Blender so that no other addon gets in the way:
+
+    blender -b --factory-startup --python tools/benchmark_library.py -- --output results.json
+
+Options after ``--``:
+    --library PATH   Library to benchmark. Defaults to the bundled library
+    --output PATH    JSON file to write the results to. Defaults to benchmark_library.json
+    --repeat N       Runs per measurement. Defaults to 5
+    --names NAME...  Node groups to load. Defaults to TS_NODETREE_NAMES, read from properties.py
+"""
+import argparse
+import ast
+import json
+import os
+import statistics
+import struct
+import sys
+import tempfile
+import time
+
+import bpy
+
+ADDON_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Magic number at the start of zstd compressed files
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+def get_toonshade_node_tree_names():
+    """Read TS_NODETREE_NAMES from properties.py without importing the addon"""
+    with open(os.path.join(ADDON_DIRECTORY, "properties.py"), encoding="utf-8") as f:
+        module = ast.parse(f.read())
+    for statement in module.body:
+        if (isinstance(statement, ast.Assign)
+                and any(isinstance(target, ast.Name) and target.id == "TS_NODETREE_NAMES" for target in statement.targets)):
+            return list(ast.literal_eval(statement.value))
+    raise RuntimeError("TS_NODETREE_NAMES not found in properties.py")
+
+def parse_args():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser(prog="benchmark_library.py")
+    parser.add_argument("--library", default=os.path.join(ADDON_DIRECTORY, "library.blend"))
+    parser.add_argument("--output", default="benchmark_library.json")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--names", nargs="+", help="Node groups to load. Defaults to TS_NODETREE_NAMES")
+    return parser.parse_args(argv)
+
+def count_blocks(filepath):
+    """Count the file blocks of an uncompressed .blend file, or None if it is compressed or not readable"""
+    with open(filepath, "rb") as f:
+        header = f.read(12)
+        if header[:4] == ZSTD_MAGIC or not header.startswith(b"BLENDER"):
+            return None
+        pointer_size = 8 if header[7:8] == b"-" else 4
+        endian = "<" if header[8:9] == b"v" else ">"
+        bhead = struct.Struct(endian + "4si" + ("Q" if pointer_size == 8 else "I") + "ii")
+        blocks = 0
+        while True:
+            data = f.read(bhead.size)
+            if len(data) < bhead.size:
+                return blocks
+            code, length = bhead.unpack(data)[:2]
+            blocks += 1
+            if code == b"ENDB":
+                return blocks
+            f.seek(length, os.SEEK_CUR)
+
+def write_variants(library_filepath, directory):
+    """Write the storage variants of the library
+
+    Returns:
+        dict: The variant file paths, by variant name
+    """
+    variants = {"original": library_filepath}
+    with bpy.data.temp_data() as temp_data:
+        with temp_data.libraries.load(library_filepath) as (lib_file, temp_file):
+            temp_file.node_groups = lib_file.node_groups
+        node_groups = set(temp_data.node_groups)
+        for name, compress in (("uncompressed", False), ("compressed", True)):
+            filepath = os.path.join(directory, name + ".blend")
+            temp_data.libraries.write(filepath, node_groups, fake_user=True, compress=compress)
+            variants[name] = filepath
+    return variants
+
+def describe_variant(filepath):
+    with open(filepath, "rb") as f:
+        is_compressed = f.read(4) == ZSTD_MAGIC
+    return {
+        "filepath": filepath,
+        "size": os.path.getsize(filepath),
+        "compressed": is_compressed,
+        "blocks": count_blocks(filepath),
+    }
+
+def drop_from_page_cache(filepath):
+    """Evict a file from the OS page cache, returns False if the OS does not allow it"""
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    fd = os.open(filepath, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+    return True
+
+def clear_loaded_data():
+    bpy.data.batch_remove(list(bpy.data.node_groups) + list(bpy.data.libraries))
+
+def time_load(filepath, tree_name, link):
+    clear_loaded_data()
+    start = time.perf_counter()
+    with bpy.data.libraries.load(filepath, link=link) as (lib_file, current_file):
+        current_file.node_groups = [tree_name]
+    seconds = time.perf_counter() - start
+    if tree_name not in bpy.data.node_groups:
+        raise RuntimeError(f"{tree_name} was not loaded from {filepath}")
+    clear_loaded_data()
+    return seconds
+
+def summarize(times):
+    return {
+        "times": times,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+    }
+
+def run_benchmark(variants, tree_names, repeat):
+    results = []
+    for variant, filepath in variants.items():
+        for tree_name in tree_names:
+            for mode, link in (("append", False), ("link", True)):
+                cold_times = []
+                for _ in range(repeat):
+                    if not drop_from_page_cache(filepath):
+                        cold_times = None
+                        break
+                    cold_times.append(time_load(filepath, tree_name, link))
+                # Once to get the file in the page cache
+                time_load(filepath, tree_name, link)
+                warm_times = [time_load(filepath, tree_name, link) for _ in range(repeat)]
+                for cache, times in (("cold", cold_times), ("warm", warm_times)):
+                    if times is None:
+                        continue
+                    results.append({
+                        "variant": variant,
+                        "node_group": tree_name,
+                        "mode": mode,
+                        "cache": cache,
+                        **summarize(times),
+                    })
+                    print(f"{variant:>12} {mode:>6} {cache:>4} {tree_name}: "
+                          f"median {results[-1]['median'] * 1000:.3f} ms")
+    return results
+
+def get_fastest_variants(results):
+    """Get the variant with the lowest total median load time, for each mode and cache state"""
+    totals = {}
+    for result in results:
+        key = f"{result['mode']}_{result['cache']}"
+        totals.setdefault(key, {}).setdefault(result["variant"], 0.0)
+        totals[key][result["variant"]] += result["median"]
+    return {key: min(variant_totals, key=variant_totals.get) for key, variant_totals in totals.items()}
+
+def main():
+    args = parse_args()
+    tree_names = args.names or get_toonshade_node_tree_names()
+    with tempfile.TemporaryDirectory() as directory:
+        variants = write_variants(os.path.abspath(args.library), directory)
+        descriptions = {variant: describe_variant(filepath) for variant, filepath in variants.items()}
+        results = run_benchmark(variants, tree_names, args.repeat)
+    output = {
+        "blender": bpy.app.version_string,
+        "platform": sys.platform,
+        "library": os.path.abspath(args.library),
+        "repeat": args.repeat,
+        "variants": descriptions,
+        "results": results,
+        "fastest": get_fastest_variants(results),
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(output, f, indent=2)
+    print(f"Fastest variants: {output['fastest']}")
+    print(f"Results written to {os.path.abspath(args.output)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""Prebuild library.json, the manifest describing the node groups of library.blend
+
+    blender -b --factory-startup --python-exit-code 1 --python tools/build_library_manifest.py
+
+The manifest is not tracked, the addon builds it on first use and writes it
+next to the library. Running this before packaging puts it in the zip, so
+installs do not have to open the library to build one. It is checked against
+the size and hash of the library, so a stale one is rebuilt rather than used.
+"""
+import json
+import os
+import sys
+
+# Blender does not put the script directory on the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from addon_module import ADDON_DIRECTORY, import_addon_module
+
+def main():
+    library = import_addon_module("library")
+    library_filepath = os.path.join(ADDON_DIRECTORY, library.LIBRARY_FILE_NAME)
+    manifest = library.build_library_manifest(library_filepath)
+    with open(library.get_manifest_filepath(library_filepath), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    print(f"Wrote the manifest of {len(manifest['node_groups'])} node groups to {library.get_manifest_filepath(library_filepath)}")
+
+if __name__ == "__main__":
+    main()
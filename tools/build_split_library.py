@@ -0,0 +1,26 @@
+"""Prebuild library_split, one .blend file per top-level node group of library.blend
+
+    blender -b --factory-startup --python-exit-code 1 --python tools/build_split_library.py
+
+The split files are not tracked, like the manifest built by
+build_library_manifest.py. Running this before packaging puts them in the
+zip, so installs append each node group from its own small file. They are
+checked against the size and hash of the library, so a stale split falls
+back to loading from library.blend.
+"""
+import os
+import sys
+
+# Blender does not put the script directory on the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from addon_module import ADDON_DIRECTORY, import_addon_module
+
+def main():
+    library = import_addon_module("library")
+    library_filepath = os.path.join(ADDON_DIRECTORY, library.LIBRARY_FILE_NAME)
+    manifest = library.split_library(library_filepath)
+    print(f"Split {len(manifest['node_groups'])} node groups into {len(manifest['files'])} files "
+          f"in {library.get_split_library_directory(library_filepath)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Check that the NumPy evaluator handles the bundled Toon Shade node groups, in a real Blender
+
+Appends every Toon Shade node group from library.blend and evaluates each of
+their outputs for a batch of (normal · light, time of day) samples.
+
+    blender -b --factory-startup --python-exit-code 1 --python tools/check_evaluator.py
+"""
+import os
+import sys
+
+import bpy
+import numpy as np
+
+# Blender does not put the script directory on the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from addon_module import ADDON_DIRECTORY, import_addon_module
+
+SAMPLE_COUNT = 64
+
+def check_node_group(evaluator, node_tree):
+    light = np.linspace(-1.0, 1.0, SAMPLE_COUNT, dtype=np.float32)
+    time_of_day = np.linspace(0.0, 1.0, SAMPLE_COUNT, dtype=np.float32)
+    outputs = [item for item in node_tree.interface.items_tree
+               if item.item_type == 'SOCKET' and item.in_out == 'OUTPUT' and item.socket_type != "NodeSocketShader"]
+    assert outputs, f"{node_tree.name} has no output to evaluate"
+    for output in outputs:
+        result = evaluator.evaluate_toonshade_samples(node_tree, light, time_of_day, output.name)
+        assert result.shape[0] == SAMPLE_COUNT, (node_tree.name, output.name, result.shape)
+        assert np.isfinite(result).all(), (node_tree.name, output.name)
+        print(f"{node_tree.name} / {output.name}: {result[0]} .. {result[-1]}")
+
+def main():
+    evaluator = import_addon_module("evaluator")
+    properties = import_addon_module("properties")
+
+    with bpy.data.libraries.load(os.path.join(ADDON_DIRECTORY, "library.blend")) as (lib_file, current_file):
+        current_file.node_groups = [name for name in properties.TS_NODETREE_NAMES if name in lib_file.node_groups]
+    assert len(current_file.node_groups) == len(properties.TS_NODETREE_NAMES), current_file.node_groups
+    for node_tree in current_file.node_groups:
+        check_node_group(evaluator, node_tree)
+
+    # Toon Shade Goo lights through a Shader Info node, which the light samples must reach
+    goo = bpy.data.node_groups["Toon Shade Goo"]
+    shaded = evaluator.evaluate_toonshade_samples(goo, np.array([-1.0, 1.0], dtype=np.float32), 0.5)
+    assert not np.allclose(shaded[0], shaded[1]), shaded
+    print("Evaluator checks passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Check how the time of day reaches Environment Color, in a real Blender
+
+Builds throwaway node trees with the node types an Environment Color tree
+mixes, and checks which node the time of day is read from.
+
+    blender -b --factory-startup --python-exit-code 1 --python tools/check_time_of_day.py
+"""
+import os
+import sys
+
+import bpy
+
+# Blender does not put the script directory on the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from addon_module import import_addon_module
+
+def new_environment_tree(environment, use_attribute):
+    node_tree = bpy.data.node_groups.new("Environment Color Check", "ShaderNodeTree")
+    node_tree.nodes.new("ShaderNodeMath")
+    node_tree.nodes.new("ShaderNodeValToRGB")
+    other_attribute = node_tree.nodes.new("ShaderNodeAttribute")
+    other_attribute.attribute_name = environment.TIME_OF_DAY_ATTRIBUTE
+    value = node_tree.nodes.new("ShaderNodeValue")
+    value.name = environment.TIME_OF_DAY_NODE_NAME
+    node_tree.links.new(value.outputs[0], node_tree.nodes["Color Ramp"].inputs["Fac"])
+    if use_attribute:
+        attribute = node_tree.nodes.new("ShaderNodeAttribute")
+        attribute.attribute_type = 'VIEW_LAYER'
+        attribute.attribute_name = environment.TIME_OF_DAY_ATTRIBUTE
+    return node_tree
+
+def check_time_of_day_source(environment):
+    node_tree = new_environment_tree(environment, use_attribute=True)
+    source = environment.get_time_of_day_source(node_tree)
+    assert source.bl_idname == "ShaderNodeAttribute" and source.attribute_type == 'VIEW_LAYER', source
+    bpy.data.node_groups.remove(node_tree)
+
+    node_tree = new_environment_tree(environment, use_attribute=False)
+    source = environment.get_time_of_day_source(node_tree)
+    assert source.bl_idname == "ShaderNodeValue", source
+    bpy.data.node_groups.remove(node_tree)
+
+def check_view_layer_conversion(environment):
+    node_tree = new_environment_tree(environment, use_attribute=False)
+    ramp_input = node_tree.nodes["Color Ramp"].inputs["Fac"]
+    # Fill the index before the conversion, so a stale one would be caught
+    assert environment.get_time_of_day_source(node_tree).bl_idname == "ShaderNodeValue"
+    assert environment.use_view_layer_time_of_day(node_tree)
+    source = environment.get_time_of_day_source(node_tree)
+    assert source.bl_idname == "ShaderNodeAttribute" and source.attribute_type == 'VIEW_LAYER', source
+    assert ramp_input.links and ramp_input.links[0].from_node == source
+    assert not environment.use_view_layer_time_of_day(node_tree)
+    bpy.data.node_groups.remove(node_tree)
+
+def main():
+    environment = import_addon_module("environment")
+    check_time_of_day_source(environment)
+    check_view_layer_conversion(environment)
+    print("Time of day checks passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+import bpy
+from bpy.app.handlers import persistent
+from bpy.types import Material, NodeTree, Object
+from typing import Dict, Set
+from .properties import TS_NODETREE_NAMES
+
+# bpy.data collections holding object data that can carry material slots
+OBDATA_COLLECTIONS = (
+    "meshes",
+    "curves",
+    "metaballs",
+    "hair_curves",
+    "pointclouds",
+    "volumes",
+    "grease_pencils",
+    )
+
+def get_group_toonshade_names(node_tree: NodeTree, group_uses: Dict[NodeTree, Set[str]]) -> Set[str]:
+    """Get the names of the Toon Shade node trees used by a node tree, nested groups included
+
+    Args:
+        node_tree (bpy.types.NodeTree): The node tree to check
+        group_uses (Dict[bpy.types.NodeTree, Set[str]]): Already known results, filled as node groups get checked
+
+    Returns:
+        Set[str]: The Toon Shade node tree names
+    """
+    if node_tree in group_uses:
+        return group_uses[node_tree]
+    names = set()
+    for node in node_tree.nodes:
+        sub_tree = getattr(node, "node_tree", None)
+        if not sub_tree:
+            continue
+        if sub_tree.name in TS_NODETREE_NAMES:
+            names.add(sub_tree.name)
+        names |= get_group_toonshade_names(sub_tree, group_uses)
+    if not node_tree.is_embedded_data:
+        group_uses[node_tree] = names
+    return names
+
+class ToonShadeUsageIndex():
+    """Scene-wide index of which materials and objects use each Toon Shade node tree.
+
+    Built in one pass over the file with ``bpy.data.user_map`` and kept up to
+    date from depsgraph updates afterwards, datablocks added or removed since
+    included.
+    """
+    def __init__(self):
+        self.tree_materials: Dict[str, Set[Material]] = {}
+        # Every material and object of the file, not only the Toon Shade ones, so that
+        # a material starting to use Toon Shade already has its objects
+        self.material_objects: Dict[Material, Set[Object]] = {}
+        self.object_materials: Dict[Object, Set[Material]] = {}
+        self.group_uses: Dict[NodeTree, Set[str]] = {}
+        self.data_counts = None
+        self.is_dirty = True
+        # Bumped whenever a Toon Shade node tree gains or loses a material or an object
+        self.revision = 0
+
+    def get_data_counts(self):
+        # Depsgraph updates do not report removed datablocks, so watch the counts instead
+        return (len(bpy.data.node_groups), len(bpy.data.materials), len(bpy.data.objects))
+
+    def ensure(self):
+        if self.is_dirty:
+            self.rebuild()
+        elif self.data_counts != self.get_data_counts():
+            self.reconcile()
+
+    def rebuild(self):
+        self.tree_materials = {name: set() for name in TS_NODETREE_NAMES}
+        self.material_objects = {material: set() for material in bpy.data.materials}
+        self.object_materials = {obj: set() for obj in bpy.data.objects}
+        self.group_uses = {}
+
+        obdata = [data for attr in OBDATA_COLLECTIONS for data in getattr(bpy.data, attr, [])]
+        subset = list(bpy.data.node_groups) + list(bpy.data.materials) + obdata
+        user_map = bpy.data.user_map(subset=subset)
+
+        # Toon Shade node tree -> node groups nesting it -> materials
+        for tree_name in TS_NODETREE_NAMES:
+            ts_tree = bpy.data.node_groups.get(tree_name)
+            if not ts_tree:
+                continue
+            stack = [ts_tree]
+            seen = {ts_tree}
+            while stack:
+                for user in user_map.get(stack.pop(), ()):
+                    if isinstance(user, Material):
+                        self.tree_materials[tree_name].add(user)
+                    elif isinstance(user, NodeTree) and user not in seen:
+                        seen.add(user)
+                        self.group_uses.setdefault(user, set()).add(tree_name)
+                        stack.append(user)
+        for node_tree in bpy.data.node_groups:
+            self.group_uses.setdefault(node_tree, set())
+
+        # Materials -> objects, either directly or through their object data
+        for material, objects in self.material_objects.items():
+            for user in user_map.get(material, ()):
+                if isinstance(user, Object):
+                    objects.add(user)
+                else:
+                    objects.update(data_user for data_user in user_map.get(user, ()) if isinstance(data_user, Object))
+            for obj in objects:
+                self.object_materials.setdefault(obj, set()).add(material)
+
+        self.data_counts = self.get_data_counts()
+        self.is_dirty = False
+        self.revision += 1
+
+    def reconcile(self):
+        """Account for the datablocks added or removed since the last update"""
+        node_group_count, material_count, object_count = self.data_counts
+        self.data_counts = self.get_data_counts()
+        if self.data_counts[1] != material_count:
+            materials = set(bpy.data.materials)
+            for material in self.material_objects.keys() - materials:
+                self.remove_material(material)
+            for material in materials - self.material_objects.keys():
+                self.update_material(material)
+        if self.data_counts[2] != object_count:
+            objects = set(bpy.data.objects)
+            for obj in self.object_materials.keys() - objects:
+                self.remove_object(obj)
+            for obj in objects - self.object_materials.keys():
+                self.update_object(obj)
+        if self.data_counts[0] != node_group_count:
+            # A removed node group may have been the one nesting Toon Shade in a material
+            self.group_uses.clear()
+            for material in self.get_toonshade_materials():
+                self.update_material(material)
+
+    def get_toonshade_materials(self) -> Set[Material]:
+        return set().union(*self.tree_materials.values())
+
+    def update_material(self, material: Material):
+        self.material_objects.setdefault(material, set())
+        names = get_group_toonshade_names(material.node_tree, self.group_uses) if material.node_tree else set()
+        for tree_name, materials in self.tree_materials.items():
+            if (tree_name in names) != (material in materials):
+                if tree_name in names:
+                    materials.add(material)
+                else:
+                    materials.discard(material)
+                self.revision += 1
+
+    def remove_material(self, material: Material):
+        for materials in self.tree_materials.values():
+            if material in materials:
+                materials.discard(material)
+                self.revision += 1
+        for obj in self.material_objects.pop(material, ()):
+            self.object_materials.get(obj, set()).discard(material)
+
+    def update_node_group(self, node_tree: NodeTree):
+        old_names = self.group_uses.pop(node_tree, None)
+        if old_names is not None and get_group_toonshade_names(node_tree, self.group_uses) != old_names:
+            # Groups nesting this one cached its old uses. Materials that just started using
+            # Toon Shade through it are updated by the depsgraph too, the ones using it may have stopped
+            self.group_uses.clear()
+            for material in self.get_toonshade_materials():
+                self.update_material(material)
+
+    def update_object(self, obj: Object):
+        materials = {slot.material for slot in obj.material_slots if slot.material}
+        old_materials = self.object_materials.get(obj)
+        if materials == old_materials:
+            return
+        old_materials = old_materials or set()
+        for material in old_materials - materials:
+            self.material_objects.get(material, set()).discard(obj)
+        for material in materials - old_materials:
+            self.material_objects.setdefault(material, set()).add(obj)
+        self.object_materials[obj] = materials
+        if not self.get_toonshade_materials().isdisjoint(materials ^ old_materials):
+            self.revision += 1
+
+    def remove_object(self, obj: Object):
+        materials = self.object_materials.pop(obj, set())
+        for material in materials:
+            self.material_objects.get(material, set()).discard(obj)
+        if not self.get_toonshade_materials().isdisjoint(materials):
+            self.revision += 1
+
+    def update(self, depsgraph):
+        if self.is_dirty:
+            return
+        if self.data_counts != self.get_data_counts():
+            self.reconcile()
+        updated = [update.id.original for update in depsgraph.updates]
+        # Node groups first, so that materials are checked against their current nesting
+        for id_data in updated:
+            if isinstance(id_data, NodeTree) and not id_data.is_embedded_data:
+                self.update_node_group(id_data)
+        for id_data in updated:
+            if isinstance(id_data, Material):
+                self.update_material(id_data)
+            elif isinstance(id_data, Object):
+                self.update_object(id_data)
+
+    def materials_using(self, tree_name: str) -> Set[Material]:
+        """Get the materials using a Toon Shade node tree, directly or through nested groups"""
+        self.ensure()
+        return set(self.tree_materials.get(tree_name, ()))
+
+    def objects_using(self, tree_name: str) -> Set[Object]:
+        """Get the objects with a material using a Toon Shade node tree"""
+        self.ensure()
+        objects = set()
+        for material in self.tree_materials.get(tree_name, ()):
+            objects |= self.material_objects.get(material, set())
+        return objects
+
+    def clear(self):
+        self.tree_materials.clear()
+        self.material_objects.clear()
+        self.object_materials.clear()
+        self.group_uses.clear()
+        self.is_dirty = True
+        self.revision += 1
+
+usage_index = ToonShadeUsageIndex()
+
+def build_usage_index():
+    """Timer callback building the usage index, so that drawing never has to"""
+    usage_index.ensure()
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'NODE_EDITOR':
+                area.tag_redraw()
+    return None
+
+def schedule_usage_index_build():
+    if not bpy.app.timers.is_registered(build_usage_index):
+        bpy.app.timers.register(build_usage_index)
+
+@persistent
+def on_depsgraph_update_post(scene, depsgraph):
+    usage_index.update(depsgraph)
+
+@persistent
+def on_data_reloaded(*args):
+    usage_index.clear()
+    schedule_usage_index_build()
+
+def register():
+    bpy.app.handlers.depsgraph_update_post.append(on_depsgraph_update_post)
+    bpy.app.handlers.load_post.append(on_data_reloaded)
+    bpy.app.handlers.undo_post.append(on_data_reloaded)
+    bpy.app.handlers.redo_post.append(on_data_reloaded)
+    schedule_usage_index_build()
+
+def unregister():
+    if bpy.app.timers.is_registered(build_usage_index):
+        bpy.app.timers.unregister(build_usage_index)
+    bpy.app.handlers.redo_post.remove(on_data_reloaded)
+    bpy.app.handlers.undo_post.remove(on_data_reloaded)
+    bpy.app.handlers.load_post.remove(on_data_reloaded)
+    bpy.app.handlers.depsgraph_update_post.remove(on_depsgraph_update_post)
+    usage_index.clear()